@@ -0,0 +1,90 @@
+"""Measure sustained accepts per second for different listen backlogs.
+
+For each backlog a server_cli.py process is started with --backlog, and
+--concurrency connectors keep reconnecting to it for --duration seconds.
+Each connection waits for the first bytes of the server key, which arrive
+once the connection has been accepted and handed to its handler thread,
+and then hangs up. Connections dropped from a full accept queue show up
+as SYN retries of a second or more in the tail latency, or as failures.
+
+    python benchmarks/bench_accept.py --backlogs 5 128 1024 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadgen import percentile
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+async def connector(port, end, timeout, latencies, failures):
+    while time.monotonic() < end:
+        started = time.monotonic()
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+            if not await asyncio.wait_for(reader.read(1), timeout):
+                raise ConnectionError("closed before the handshake")
+            latencies.append((time.monotonic() - started) * 1000.0)
+        except (OSError, asyncio.TimeoutError):
+            failures.append(1)
+        finally:
+            if writer is not None:
+                writer.close()
+
+async def hammer(port, concurrency, duration, timeout):
+    latencies = []
+    failures = []
+    end = time.monotonic() + duration
+    started = time.monotonic()
+    await asyncio.gather(*(connector(port, end, timeout, latencies, failures) for _ in range(concurrency)))
+    return latencies, len(failures), time.monotonic() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backlogs', type=int, nargs='+', default=[5, 128, 1024])
+    parser.add_argument('--concurrency', type=int, default=200, help="connections kept in flight")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--timeout', type=float, default=10.0, help="seconds before a connect counts as failed")
+    parser.add_argument('--port', type=int, default=13400)
+    args = parser.parse_args()
+
+    print(f"{'backlog':>8} {'accepts/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'failed':>7}")
+    for backlog in args.backlogs:
+        command = [
+            sys.executable, os.path.join(ROOT, 'server_cli.py'),
+            '--host', '127.0.0.1', '--port', str(args.port),
+            '--backlog', str(backlog), '--no-console',
+            '--heartbeat-interval', '0', '--presence-interval', '0',
+        ]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(args.port)
+            latencies, failed, elapsed = asyncio.run(
+                hammer(args.port, args.concurrency, args.duration, args.timeout))
+        finally:
+            server.terminate()
+            server.wait()
+        latencies.sort()
+        print(f"{backlog:>8} {len(latencies) / elapsed:>10.0f} {percentile(latencies, 50):>8.1f} "
+              f"{percentile(latencies, 99):>8.1f} {latencies[-1] if latencies else 0.0:>8.1f} {failed:>7}",
+              flush=True)
+        args.port += 1
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Run loadgen against 1..N linked server nodes on loopback ports.
+
+Each node is a separate server_cli.py process with --no-console. Node i
+dials every node before it, giving a full mesh, and loadgen spreads its
+clients across all nodes. Deliveries count messages received by every
+client on every node, so compare the delivery rate between node counts
+for aggregate throughput.
+
+    python benchmarks/bench_federation.py --nodes 1 3 --clients 60 --rate 2
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"node on port {port} did not start")
+
+def start_nodes(count, base_port, rate_limit):
+    nodes = []
+    for i in range(count):
+        command = [
+            sys.executable, os.path.join(ROOT, 'server_cli.py'),
+            '--host', '127.0.0.1', '--port', str(base_port + i),
+            '--node-id', f"n{i}", '--link-secret', 'bench', '--no-console',
+            '--max-messages-per-second', str(rate_limit),
+        ]
+        for j in range(i):
+            command += ['--peer', f"127.0.0.1:{base_port + j}"]
+        nodes.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    for i in range(count):
+        wait_for_port(base_port + i)
+    return nodes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--base-port', type=int, default=13000)
+    parser.add_argument('--clients', type=int, default=60)
+    parser.add_argument('--rate', type=float, default=2.0)
+    parser.add_argument('--size', type=int, default=36)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    for count in args.nodes:
+        nodes = start_nodes(count, args.base_port, rate_limit=max(args.rate * 2, 5))
+        try:
+            # Give the dialling nodes time to link up (and retry once)
+            time.sleep(3 if count > 1 else 0.5)
+            print(f"=== {count} node(s) ===", flush=True)
+            command = [
+                sys.executable, os.path.join(ROOT, 'loadgen.py'),
+                '--clients', str(args.clients), '--rate', str(args.rate),
+                '--size', str(args.size), '--duration', str(args.duration),
+                '--workers', str(args.workers), '--mode', 'process',
+                '--connect-timeout', '30',
+            ]
+            for i in range(count):
+                command += ['--server', f"127.0.0.1:{args.base_port + i}"]
+            subprocess.run(command, check=True)
+        finally:
+            for node in nodes:
+                node.terminate()
+            for node in nodes:
+                node.wait()
+        args.base_port += count
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Compare RSA key generation, encryption and decryption across backends.
+
+Every available backend in rsa.BACKENDS is timed on the same key sizes.
+Prime candidates are drawn from a random.Random seeded the same way for
+each backend, separate from the randomness the primality tests use, so
+all of them test the same candidates and differ only in the arithmetic.
+
+    python benchmarks/bench_rsa.py --bits 512 1024 2048 --keys 5 --messages 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rsa
+
+MESSAGE = "Client #12: the quick brown fox jumps over the lazy dog"
+
+def time_keygen(bits, keys, seed):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for _ in range(keys):
+        public_key, private_key = rsa.generate_keys(bits, rng)
+    return (time.perf_counter() - started) / keys, public_key, private_key
+
+def time_crypt(public_key, private_key, messages):
+    started = time.perf_counter()
+    ciphertexts = [rsa.encrypt_text(MESSAGE, public_key) for _ in range(messages)]
+    encrypt_time = (time.perf_counter() - started) / messages
+
+    started = time.perf_counter()
+    for ciphertext in ciphertexts:
+        assert rsa.decrypt_text(ciphertext, private_key) == MESSAGE
+    decrypt_time = (time.perf_counter() - started) / messages
+    return encrypt_time, decrypt_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bits', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--keys', type=int, default=5, help="keys generated per size")
+    parser.add_argument('--messages', type=int, default=500, help="messages encrypted per size")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if 'gmpy2' not in rsa.BACKENDS:
+        print("gmpy2 is not installed; only the python backend can be measured")
+
+    print(f"{'backend':>8} {'bits':>6} {'keygen ms':>10} {'encrypt us':>11} {'decrypt us':>11}")
+    for bits in args.bits:
+        for name in rsa.BACKENDS:
+            rsa.set_backend(name)
+            keygen_time, public_key, private_key = time_keygen(bits, args.keys, args.seed)
+            encrypt_time, decrypt_time = time_crypt(public_key, private_key, args.messages)
+            print(f"{name:>8} {bits:>6} {keygen_time * 1e3:>10.1f} {encrypt_time * 1e6:>11.1f} "
+                  f"{decrypt_time * 1e6:>11.1f}", flush=True)
+
+if __name__ == "__main__":
+    main()
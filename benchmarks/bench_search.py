@@ -0,0 +1,93 @@
+"""Measure SearchIndex memory and query latency over a large chat history.
+
+Messages are drawn from a Zipf-like vocabulary, so a few words appear in
+most messages and most words are rare, roughly like real chat. Memory is
+what tracemalloc sees the index holding after all messages are added
+(message lines included). Each query kind is run --queries times with
+random words from its frequency band.
+
+    python benchmarks/bench_search.py --messages 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from loadgen import percentile
+from search import SearchIndex
+
+def build(args, vocabulary, weights, started_at):
+    """Fill an index with the same seeded history every time; returns it and the seconds spent adding."""
+    rng = random.Random(args.seed)
+    index = SearchIndex(retention=3600.0, max_messages=args.messages)
+    step = 3600.0 / args.messages
+    add_time = 0.0
+    for chunk in range(0, args.messages, 10000):
+        count = min(10000, args.messages - chunk)
+        words = rng.choices(vocabulary, weights, k=count * args.words)
+        texts = [" ".join(words[i:i + args.words]) for i in range(0, len(words), args.words)]
+        started = time.perf_counter()
+        for i, text in enumerate(texts):
+            index.add(f"Client #{(chunk + i) % 100}: {text}", text, started_at + (chunk + i) * step)
+        add_time += time.perf_counter() - started
+    return index, add_time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--words', type=int, default=8, help="words per message")
+    parser.add_argument('--queries', type=int, default=1000, help="queries per kind")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    vocabulary = [f"w{i}" for i in range(args.vocabulary)]
+    weights = [1.0 / (rank + 1) for rank in range(args.vocabulary)]
+    # One hour of history, spread evenly
+    started_at = time.time() - 3600.0
+
+    # Tracing slows allocation down, so memory and speed are measured on separate builds
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    index, _ = build(args, vocabulary, weights, started_at)
+    memory = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del index
+
+    index, add_time = build(args, vocabulary, weights, started_at)
+    stats = index.snapshot()
+    print(f"{stats['messages']} messages, {stats['terms']} terms, {stats['postings']} postings")
+    print(f"add: {add_time / args.messages * 1e6:.1f} us/message, "
+          f"memory: {memory / 1e6:.0f} MB ({memory / args.messages:.0f} B/message)")
+
+    rng = random.Random(args.seed)
+    common = vocabulary[:20]
+    middle = vocabulary[200:2000]
+    rare = vocabulary[10000:]
+    now = time.time()
+    kinds = [
+        ("common word", lambda: ([rng.choice(common)], None)),
+        ("rare word", lambda: ([rng.choice(rare)], None)),
+        ("common AND common", lambda: (rng.sample(common, 2), None)),
+        ("common AND middle", lambda: ([rng.choice(common), rng.choice(middle)], None)),
+        ("middle AND middle", lambda: (rng.sample(middle, 2), None)),
+        ("middle, last 5 min", lambda: ([rng.choice(middle)], now - 300)),
+    ]
+    print(f"{'query':>20} {'p50 us':>8} {'p99 us':>8} {'max us':>9} {'hits':>6}")
+    for name, make in kinds:
+        latencies = []
+        hits = 0
+        for _ in range(args.queries):
+            terms, since = make()
+            started = time.perf_counter()
+            hits += len(index.search(terms, since=since))
+            latencies.append((time.perf_counter() - started) * 1e6)
+        latencies.sort()
+        print(f"{name:>20} {percentile(latencies, 50):>8.1f} {percentile(latencies, 99):>8.1f} "
+              f"{latencies[-1]:>9.1f} {hits / args.queries:>6.1f}")
+
+if __name__ == "__main__":
+    main()
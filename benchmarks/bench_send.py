@@ -0,0 +1,123 @@
+"""Compare the pickle-per-recipient send path with FrameTemplate framing.
+
+Both paths write the same ciphertexts to a local socket pair that a
+background thread drains, so the numbers cover framing and the send
+syscall but not encryption. The paths take turns, repeat after repeat,
+and the fastest round of each is kept, so drift in machine load hits
+both alike. Framing alone, without the socket, is timed the same way.
+
+Before timing, template frames are checked to unpickle to the same dict
+as pickle.dumps() would send, at the lengths where the hand-written
+encoding changes (zero, and the LONG1/LONG4 switch at 256 bytes).
+
+    python benchmarks/bench_send.py --recipients 100 --rounds 200
+"""
+import argparse
+import os
+import pickle
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from protocol import FrameTemplate, FrameDecoder
+
+def drain(sock):
+    # recv_into a buffer allocated once, so this thread doesn't show up in
+    # the memory figures
+    buffer = bytearray(65536)
+    while sock.recv_into(buffer):
+        pass
+
+def check_roundtrip():
+    """Raise AssertionError unless template frames decode to the right dict."""
+    template = FrameTemplate({'sender': "client_1"})
+    ciphertexts = [0, 1, 127, 128, 255, 256, 2 ** 512 - 1]
+    # Payloads of 254 to 257 bytes, either side of the LONG1/LONG4 switch
+    for size in (254, 255, 256, 257):
+        ciphertexts += [2 ** (8 * size - 9), 2 ** (8 * size - 1) - 1]
+    for ciphertext in ciphertexts:
+        expected = {'sender': "client_1", 'encrypted_message': ciphertext}
+        frame = b''.join(template.buffers(ciphertext))
+        assert frame == template.frame(ciphertext)
+        assert pickle.loads(frame) == expected, ciphertext
+        assert FrameDecoder().feed(frame) == [(expected, len(frame))], ciphertext
+
+def pickle_path(sock, ciphertexts, sender_id):
+    for ciphertext in ciphertexts:
+        message_data = {
+            'sender': f"client_{sender_id}",
+            'encrypted_message': ciphertext
+        }
+        sock.sendall(pickle.dumps(message_data))
+
+def template_path(sock, ciphertexts, sender_id):
+    template = FrameTemplate({'sender': f"client_{sender_id}"})
+    for ciphertext in ciphertexts:
+        sock.sendall(template.frame(ciphertext))
+
+def pickle_framing(sock, ciphertexts, sender_id):
+    for ciphertext in ciphertexts:
+        pickle.dumps({'sender': f"client_{sender_id}", 'encrypted_message': ciphertext})
+
+def template_framing(sock, ciphertexts, sender_id):
+    template = FrameTemplate({'sender': f"client_{sender_id}"})
+    for ciphertext in ciphertexts:
+        template.frame(ciphertext)
+
+def best_times(paths, sock, ciphertexts, rounds, repeats):
+    """Fastest run of each path, with the paths interleaved."""
+    best = {name: None for name, _ in paths}
+    for _ in range(repeats):
+        for name, path in paths:
+            start = time.perf_counter()
+            for sender_id in range(rounds):
+                path(sock, ciphertexts, sender_id)
+            elapsed = time.perf_counter() - start
+            best[name] = elapsed if best[name] is None else min(best[name], elapsed)
+    return best
+
+def peak_memory(path, sock, ciphertexts):
+    """Bytes allocated on top of the baseline while sending one broadcast."""
+    tracemalloc.start()
+    path(sock, ciphertexts, 0)  # Warm up caches
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    path(sock, ciphertexts, 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - baseline
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--key-bits', type=int, default=512)
+    parser.add_argument('--repeats', type=int, default=15)
+    args = parser.parse_args()
+
+    check_roundtrip()
+    ciphertexts = [random.getrandbits(args.key_bits) for _ in range(args.recipients)]
+    writer, reader = socket.socketpair()
+    threading.Thread(target=drain, args=(reader,), daemon=True).start()
+
+    print(f"{args.recipients} recipients x {args.rounds} broadcasts, {args.key_bits}-bit ciphertexts")
+    frames = args.rounds * args.recipients
+    sent = best_times((("pickle", pickle_path), ("template", template_path)),
+                      writer, ciphertexts, args.rounds, args.repeats)
+    framed = best_times((("pickle", pickle_framing), ("template", template_framing)),
+                        writer, ciphertexts, args.rounds, args.repeats)
+    for name, path in (("pickle", pickle_path), ("template", template_path)):
+        print(f"{name:10} {frames / sent[name]:12,.0f} frames/s  "
+              f"{sent[name] / frames * 1e6:8.2f} us/frame sent  "
+              f"{framed[name] / frames * 1e6:6.2f} us/frame framing only  "
+              f"{peak_memory(path, writer, ciphertexts):8,} bytes peak per broadcast")
+    print(f"speedup: {sent['pickle'] / sent['template']:.2f}x sent, "
+          f"{framed['pickle'] / framed['template']:.2f}x framing only")
+    writer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import struct
+import threading
+import time
+
+# Record kinds
+CONNECT = 1
+MESSAGE = 2
+DISCONNECT = 3
+
+MAGIC = b'RGCT'
+VERSION = 1
+HEADER = struct.Struct('<4sBQ')     # magic, version, capture start (unix µs)
+RECORD = struct.Struct('<BQIIH')    # kind, µs since start, client id, frame bytes, text length in UTF-8 bytes
+
+class TraceWriter:
+    """Append connection events and frame sizes to a binary trace file.
+
+    Each record is a fixed RECORD.size bytes: what happened, when (relative
+    to the start of the capture), which client, and for messages the size of
+    the frame on the wire and of the decrypted text. Message contents are
+    never written. record() may be called from any thread.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.file.write(HEADER.pack(MAGIC, VERSION, time.time_ns() // 1000))
+        self.count = 0
+
+    def record(self, kind, client_id, frame_size=0, text_length=0):
+        elapsed_us = int((time.monotonic() - self.started) * 1000000)
+        data = RECORD.pack(kind, elapsed_us, client_id, frame_size, min(text_length, 0xFFFF))
+        with self.lock:
+            if self.file is not None:
+                self.file.write(data)
+                self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def read_trace(path, chunk_records=4096):
+    """Yield (kind, seconds, client_id, frame_size, text_length) from a trace file."""
+    with open(path, 'rb') as trace_file:
+        magic, version, _ = HEADER.unpack(trace_file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} trace file")
+        while True:
+            chunk = trace_file.read(RECORD.size * chunk_records)
+            if not chunk:
+                break
+            # Ignore a partial record left by a server that was killed mid-write
+            usable = len(chunk) - len(chunk) % RECORD.size
+            for kind, elapsed_us, client_id, frame_size, text_length in RECORD.iter_unpack(chunk[:usable]):
+                yield kind, elapsed_us / 1000000.0, client_id, frame_size, text_length
@@ -0,0 +1,226 @@
+import bisect
+import threading
+import tkinter as tk
+from tkinter import ttk
+from collections import deque
+from datetime import datetime
+
+RENDER_INTERVAL_MS = 33  # About 30 frames per second
+DEFAULT_SCROLLBACK = 5000
+
+class ChatRenderQueue:
+    """Batch chat lines and draw them into a Text widget at a fixed rate.
+
+    put() only appends to a queue and may be called from any thread. The
+    Tk thread drains the queue every interval_ms with a single insert, trims
+    the widget to max_lines and only autoscrolls if the view was already at
+    the bottom, so a message flood cannot swamp the Tk event queue.
+    """
+    def __init__(self, root, widget, max_lines=DEFAULT_SCROLLBACK, interval_ms=RENDER_INTERVAL_MS):
+        self.root = root
+        self.widget = widget
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        # Lines beyond the scrollback would be trimmed straight away, so
+        # don't keep more than that waiting either
+        self.pending = deque(maxlen=max_lines)
+        self.after_id = self.root.after(self.interval_ms, self.drain)
+
+    def put(self, message, tag=None):
+        timestamp = datetime.now().strftime("[%H:%M:%S] ")
+        self.pending.append((timestamp, message, tag))
+
+    def drain(self):
+        try:
+            if self.pending:
+                self.render()
+        finally:
+            self.after_id = self.root.after(self.interval_ms, self.drain)
+
+    def render(self):
+        chunks = []
+        while self.pending:
+            timestamp, message, tag = self.pending.popleft()
+            chunks.extend((timestamp, "timestamp", message + "\n", tag or ""))
+
+        # Only follow new output if the user hasn't scrolled up
+        follow = self.widget.yview()[1] >= 1.0
+
+        self.widget.config(state=tk.NORMAL)
+        self.widget.insert(tk.END, *chunks)
+
+        # The widget always ends with an empty line after the last newline
+        line_count = int(self.widget.index("end-1c").split(".")[0]) - 1
+        excess = line_count - self.max_lines
+        if excess > 0:
+            self.widget.delete("1.0", f"{excess + 1}.0")
+
+        self.widget.config(state=tk.DISABLED)
+        if follow:
+            self.widget.see(tk.END)
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+class ClientListView:
+    """Paged, filterable client list that is updated one entry at a time.
+
+    join() and leave() may be called from any thread. Events are coalesced
+    and applied once per tick, and only the visible page is kept in the
+    Listbox, so the cost of a join or leave doesn't grow with the number
+    of connected clients.
+    """
+    def __init__(self, root, parent, page_size=200, interval_ms=RENDER_INTERVAL_MS):
+        self.root = root
+        self.page_size = page_size
+        self.interval_ms = interval_ms
+
+        self.labels = {}   # {client_id: label} for every connected client
+        self.ids = []      # Sorted client ids
+        self.matches = self.ids  # Sorted ids that pass the filter
+        self.offset = 0    # Index in matches of the first visible row
+        self.lock = threading.Lock()
+        self.pending = {}  # {client_id: label, or None for a leave}
+        self.filter_changed = False
+
+        # Search box
+        self.filter_text = tk.StringVar()
+        self.filter_text.trace_add("write", self.on_filter_change)
+        ttk.Entry(parent, textvariable=self.filter_text).pack(fill=tk.X, pady=(0, 5))
+
+        self.listbox = tk.Listbox(parent, width=20, height=15)
+        self.listbox.pack(fill=tk.BOTH, expand=True)
+
+        # Page navigation
+        nav_frame = ttk.Frame(parent)
+        nav_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(nav_frame, text="<", width=2, command=self.previous_page).pack(side=tk.LEFT)
+        ttk.Button(nav_frame, text=">", width=2, command=self.next_page).pack(side=tk.RIGHT)
+        self.page_label = ttk.Label(nav_frame, anchor=tk.CENTER)
+        self.page_label.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.update_page_label()
+
+        self.after_id = self.root.after(self.interval_ms, self.tick)
+
+    def join(self, client_id, label):
+        with self.lock:
+            self.pending[client_id] = label
+
+    def leave(self, client_id):
+        with self.lock:
+            self.pending[client_id] = None
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+        self.labels.clear()
+        self.ids.clear()
+        self.matches = self.ids if not self.filter_text.get() else []
+        self.offset = 0
+        self.listbox.delete(0, tk.END)
+        self.update_page_label()
+
+    def tick(self):
+        try:
+            with self.lock:
+                events, self.pending = self.pending, {}
+            for client_id, label in events.items():
+                if label is None:
+                    self.remove(client_id)
+                else:
+                    self.add(client_id, label)
+            if self.filter_changed:
+                self.filter_changed = False
+                self.apply_filter()
+            elif self.offset and self.offset >= len(self.matches):
+                # The last page emptied out
+                self.previous_page()
+            elif events:
+                self.update_page_label()
+        finally:
+            self.after_id = self.root.after(self.interval_ms, self.tick)
+
+    def add(self, client_id, label):
+        if client_id in self.labels:
+            return
+        self.labels[client_id] = label
+        bisect.insort(self.ids, client_id)
+        if self.matches is not self.ids:
+            if not self.matches_filter(label):
+                return
+            bisect.insort(self.matches, client_id)
+
+        position = bisect.bisect_left(self.matches, client_id)
+        if position < self.offset:
+            # Keep the same rows on screen
+            self.offset += 1
+        elif position < self.offset + self.page_size:
+            self.listbox.insert(position - self.offset, label)
+            if self.listbox.size() > self.page_size:
+                self.listbox.delete(self.page_size)
+
+    def remove(self, client_id):
+        label = self.labels.pop(client_id, None)
+        if label is None:
+            return
+        del self.ids[bisect.bisect_left(self.ids, client_id)]
+        if self.matches is not self.ids:
+            position = bisect.bisect_left(self.matches, client_id)
+            if position >= len(self.matches) or self.matches[position] != client_id:
+                return
+            del self.matches[position]
+        else:
+            position = bisect.bisect_left(self.matches, client_id)
+
+        if position < self.offset:
+            self.offset -= 1
+        elif position < self.offset + self.page_size:
+            self.listbox.delete(position - self.offset)
+            # Pull the next row up into the page
+            last = self.offset + self.page_size - 1
+            if last < len(self.matches):
+                self.listbox.insert(tk.END, self.labels[self.matches[last]])
+
+    def matches_filter(self, label):
+        return self.filter_text.get().lower() in label.lower()
+
+    def on_filter_change(self, *args):
+        self.filter_changed = True
+
+    def apply_filter(self):
+        needle = self.filter_text.get().lower()
+        if needle:
+            self.matches = [i for i in self.ids if needle in self.labels[i].lower()]
+        else:
+            self.matches = self.ids
+        self.offset = 0
+        self.show_page()
+
+    def show_page(self):
+        visible = self.matches[self.offset:self.offset + self.page_size]
+        self.listbox.delete(0, tk.END)
+        if visible:
+            self.listbox.insert(tk.END, *(self.labels[i] for i in visible))
+        self.update_page_label()
+
+    def previous_page(self):
+        if self.offset > 0:
+            self.offset = max(self.offset - self.page_size, 0)
+            self.show_page()
+
+    def next_page(self):
+        if self.offset + self.page_size < len(self.matches):
+            self.offset += self.page_size
+            self.show_page()
+
+    def update_page_label(self):
+        total = len(self.matches)
+        if total == 0:
+            text = "No clients"
+        else:
+            first = min(self.offset + 1, total)
+            last = min(self.offset + self.page_size, total)
+            text = f"{first}-{last} of {total:,}"
+        self.page_label.config(text=text)
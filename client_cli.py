@@ -1,123 +1,164 @@
-import socket
+import asyncio
+import os
+from collections import deque
 import threading
-import json
-import pickle
-import time
 import sys
-from rsa import generate_keys, encrypt_text, decrypt_text
+from client_core import AsyncClient, load_or_create_keys
+from file_transfer import FileTransfers, MAX_FILE_SIZE, OFFER_TIMEOUT, format_size
+from tracing import LatencyTracer
 
 class Client:
-    def __init__(self, host='localhost', port=9999):
+    """Terminal front-end for AsyncClient."""
+    def __init__(self, host='localhost', port=9999, key_file=None, trace_file=None, max_file_size=MAX_FILE_SIZE):
         self.host = host
         self.port = port
-        self.client_socket = None
-        self.public_key, self.private_key = generate_keys(bit_length=512)
-        self.server_public_key = None
-        self.running = True
-        self.connected = False
+        keys = load_or_create_keys(key_file) if key_file else None
+        self.tracer = LatencyTracer(trace_file) if trace_file else None
+        self.core = AsyncClient(host, port, keys=keys, tracer=self.tracer)
+        self.loop = None
+        self.lines = None
+        self.transfers = FileTransfers(self.core, on_event=self.handle_message,
+                                       max_size=max_file_size, ask=self.ask_file)
+        self.sending = set()  # File transfer tasks still running
+        self.offers = deque()  # Futures for file offers waiting for /accept or /reject, oldest first
     
     def connect(self):
         """Connect to the server and start communication."""
+        asyncio.run(self.run())
+    
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.lines = asyncio.Queue()
+        
         try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.host, self.port))
-            self.connected = True
-            print(f"Connected to server at {self.host}:{self.port}")
-            print(f"Client public key: {self.public_key}")
-            
-            # Receive server's public key
-            server_public_key_data = self.client_socket.recv(4096)
-            self.server_public_key = pickle.loads(server_public_key_data)
-            print(f"Received server public key: {self.server_public_key}")
-            
-            # Send our public key to the server
-            self.client_socket.send(pickle.dumps(self.public_key))
-            
-            # Start receiving messages from server in a separate thread
-            receive_thread = threading.Thread(target=self.receive_messages)
-            receive_thread.daemon = True
-            receive_thread.start()
-            
-            # Start sending messages
-            self.send_messages()
-            
+            await self.core.connect()
         except Exception as e:
             print(f"Error connecting to server: {e}")
-            self.disconnect()
+            return
+        
+        print(f"Connected to server at {self.host}:{self.port}")
+        print(f"Client public key: {self.core.public_key}")
+        print(f"Received server public key: {self.core.server_public_key}")
+        
+        self.core.add_handler(self.handle_message)
+        self.core.add_disconnect_handler(self.handle_disconnect)
+        
+        try:
+            await self.send_messages()
+        finally:
+            await self.disconnect()
+    
+    def handle_message(self, message):
+        """Display a decrypted message from the server."""
+        print(f"\n{message}")
+        print("You: ", end="", flush=True)  # Restore user prompt
+    
+    def handle_disconnect(self, reason):
+        """Stop the input loop when the server goes away."""
+        print(f"\n{reason}.")
+        self.lines.put_nowait(None)
     
-    def receive_messages(self):
-        """Receive and decrypt messages from the server."""
-        while self.running and self.connected:
+    def read_input(self):
+        """Read console lines on a helper thread so input() never blocks the event loop."""
+        while True:
             try:
-                # Receive encrypted message from server
-                data = self.client_socket.recv(4096)
-                
-                if not data:
-                    print("Server connection closed.")
-                    self.disconnect()
-                    break
-                
-                message_data = pickle.loads(data)
-                encrypted_message = message_data.get('encrypted_message')
-                
-                # Decrypt the message using our private key
-                decrypted_message = decrypt_text(encrypted_message, self.private_key)
-                print(f"\n{decrypted_message}")
-                print("You: ", end="", flush=True)  # Restore user prompt
-                
-            except ConnectionResetError:
-                print("\nServer connection was reset.")
-                self.disconnect()
-                break
-            except Exception as e:
-                print(f"\nError receiving message: {e}")
-                self.disconnect()
+                line = input("You: ")
+            except EOFError:
+                line = None
+            
+            try:
+                self.loop.call_soon_threadsafe(self.lines.put_nowait, line)
+            except RuntimeError:
+                break  # Event loop already closed
+            if line is None or line.lower() == '/quit':
                 break
     
-    def send_messages(self):
+    async def send_messages(self):
         """Send encrypted messages to the server."""
         print("You can now send messages. Type your message and press Enter. Type '/quit' to exit.")
+        print("Type '/send <client_id> <path>' to send a file, '/accept' or '/reject' to answer an offer.")
+        print("Type '/search <words> [since:30m] [until:14:30]' to search recent messages.")
         
-        while self.running and self.connected:
-            try:
-                message = input("You: ")
-                
-                if message.lower() == '/quit':
-                    print("Disconnecting from server...")
-                    self.disconnect()
-                    break
-                
-                if message and self.server_public_key:
-                    # Encrypt message with server's public key
-                    encrypted_message = encrypt_text(message, self.server_public_key)
-                    message_data = {
-                        'encrypted_message': encrypted_message
-                    }
-                    self.client_socket.send(pickle.dumps(message_data))
+        input_thread = threading.Thread(target=self.read_input)
+        input_thread.daemon = True
+        input_thread.start()
+        
+        while self.core.connected:
+            message = await self.lines.get()
             
-            except EOFError:
+            if message is None:
                 # Handle Ctrl+D (EOF) gracefully
-                print("\nDisconnecting from server...")
-                self.disconnect()
+                if self.core.connected:
+                    print("\nDisconnecting from server...")
                 break
-            except Exception as e:
-                print(f"Error sending message: {e}")
-                self.disconnect()
+            
+            if message.lower() == '/quit':
+                print("Disconnecting from server...")
                 break
+            
+            if message.startswith('/send'):
+                self.start_file_transfer(message)
+            elif message.lower() in ('/accept', '/reject'):
+                self.answer_offer(message.lower() == '/accept')
+            elif message:
+                try:
+                    await self.core.send(message)
+                except Exception as e:
+                    print(f"Error sending message: {e}")
+                    break
     
-    def disconnect(self):
-        """Disconnect from the server and clean up."""
-        self.running = False
-        self.connected = False
-        
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
-            finally:
-                self.client_socket = None
+    def start_file_transfer(self, command):
+        """Start sending a file in the background so chatting can carry on."""
+        parts = command.split(maxsplit=2)
+        if len(parts) != 3 or not parts[1].isdigit():
+            print("Usage: /send <client_id> <path>")
+            return
+        path = os.path.expanduser(parts[2])
+        if not os.path.isfile(path):
+            print(f"No such file: {path}")
+            return
         
+        task = asyncio.ensure_future(self.send_file(int(parts[1]), path))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+    
+    async def ask_file(self, sender_id, name, size):
+        """Ask whether to receive a file; /accept or /reject answers the oldest offer."""
+        answer = self.loop.create_future()
+        self.offers.append(answer)
+        self.handle_message(f"Client #{sender_id} wants to send you {name} ({format_size(size)}). "
+                            "Type /accept or /reject.")
+        try:
+            return await asyncio.wait_for(answer, OFFER_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.handle_message(f"No answer, refused {name}")
+            return False
+        finally:
+            if answer in self.offers:
+                self.offers.remove(answer)
+    
+    def answer_offer(self, accept):
+        while self.offers:
+            answer = self.offers.popleft()
+            if not answer.done():
+                answer.set_result(accept)
+                return
+        print("No file offers are waiting.")
+    
+    async def send_file(self, client_id, path):
+        try:
+            await self.transfers.send_file(client_id, path)
+        except Exception as e:
+            self.handle_message(f"Error sending {os.path.basename(path)}: {e}")
+    
+    async def disconnect(self):
+        """Disconnect from the server and clean up."""
+        for task in list(self.sending):
+            task.cancel()
+        await self.core.close()
+        self.transfers.close()
+        if self.tracer is not None:
+            self.tracer.close()
         print("Disconnected from server.")
 
 if __name__ == "__main__":
@@ -125,20 +166,40 @@ if __name__ == "__main__":
     host = '192.168.236.135'
     port = 12345
     
-    if len(sys.argv) > 1:
-        host = sys.argv[1]
-    if len(sys.argv) > 2:
+    # --key-file PATH keeps the same keys between runs, so the server
+    # can hold messages for this client while it is offline.
+    # --trace-latency PATH logs traced messages for latency_report.py.
+    # --max-file-size MB refuses bigger incoming files without asking.
+    usage = "Usage: client_cli.py [server_ip] [port] [--key-file PATH] [--trace-latency PATH] [--max-file-size MB]"
+    args = sys.argv[1:]
+    options = {'--key-file': None, '--trace-latency': None, '--max-file-size': None}
+    for option in options:
+        if option in args:
+            index = args.index(option)
+            if index + 1 >= len(args):
+                sys.exit(usage)
+            options[option] = args[index + 1]
+            del args[index:index + 2]
+    max_file_size = MAX_FILE_SIZE
+    if options['--max-file-size'] is not None:
+        try:
+            max_file_size = int(float(options['--max-file-size']) * 1024 * 1024)
+        except ValueError:
+            sys.exit(usage)
+    
+    if len(args) > 0:
+        host = args[0]
+    if len(args) > 1:
         try:
-            port = int(sys.argv[2])
+            port = int(args[1])
         except ValueError:
-            print(f"Invalid port number: {sys.argv[2]}. Using default: 9999")
+            print(f"Invalid port number: {args[1]}. Using default: 9999")
     
-    client = Client(host, port)
+    client = Client(host, port, key_file=options['--key-file'], trace_file=options['--trace-latency'],
+                    max_file_size=max_file_size)
     try:
         client.connect()
     except KeyboardInterrupt:
         print("\nClient interrupted by user.")
-        client.disconnect()
     except Exception as e:
         print(f"Unexpected error: {e}")
-        client.disconnect()
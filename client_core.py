@@ -0,0 +1,306 @@
+import asyncio
+import inspect
+import json
+import os
+import pickle
+import secrets
+import time
+from collections import deque
+from rsa import generate_keys, encrypt_text, decrypt_text, sign
+from protocol import FrameDecoder, PONG_FRAME, login_message
+from store_forward import fingerprint
+
+def load_or_create_keys(path, bit_length=512):
+    """Load a key pair from path, generating and saving one if it doesn't exist.
+
+    Reusing keys lets the server recognise the client across connections.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        return tuple(data['public_key']), tuple(data['private_key'])
+    except FileNotFoundError:
+        pass
+
+    public_key, private_key = generate_keys(bit_length=bit_length)
+    # The private key shouldn't be readable by other users
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'public_key': public_key, 'private_key': private_key}, f)
+    return public_key, private_key
+
+class AsyncClient:
+    """Chat connection, key exchange and message crypto on top of asyncio.
+
+    This has no terminal or Tk dependencies so it can be shared by the
+    front-ends, bots and load tools. Many clients can run in one event loop:
+
+        client = AsyncClient(host, port)
+        await client.connect()
+        await client.send("hello")
+        async for message in client.messages():
+            ...
+
+    With a tracer (a tracing.LatencyTracer), every sent message carries a
+    trace id and its compose time, and traced messages received are logged
+    as they arrive and are delivered.
+    """
+    def __init__(self, host='localhost', port=12345, keys=None, bufsize=4096, tracer=None):
+        self.host = host
+        self.port = port
+        self.bufsize = bufsize
+        if keys is None:
+            keys = generate_keys(bit_length=512)
+        self.public_key, self.private_key = keys
+        self.server_public_key = None
+        self.connected = False
+        self.reader = None
+        self.writer = None
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+        self.receive_task = None
+        self.closing = False
+        self.handlers = []
+        self.disconnect_handlers = []
+        self.frame_handlers = {}  # {frame type: handler(frame)}
+        self.key_requests = {}    # {client_id: [futures waiting for its public key]}
+        self.queues = []
+        self.tracer = tracer
+        self.fingerprint = fingerprint(self.public_key) if tracer else None
+
+    def add_handler(self, handler):
+        """Call handler(message) for every decrypted message.
+
+        Handlers may be plain functions or coroutine functions. An exception
+        raised by a handler ends the connection.
+        """
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        self.handlers.remove(handler)
+
+    def add_frame_handler(self, frame_type, handler):
+        """Call handler(frame) for every frame whose 'type' is frame_type.
+
+        This is for frames other than chat messages, such as file transfer
+        frames. Like message handlers, it may be a coroutine function.
+        """
+        self.frame_handlers[frame_type] = handler
+
+    def add_disconnect_handler(self, handler):
+        """Call handler(reason) when the server ends the connection or it fails.
+
+        Disconnect handlers are not called after a local close().
+        """
+        self.disconnect_handlers.append(handler)
+
+    async def connect(self, timeout=None):
+        """Connect to the server and exchange public keys.
+
+        Raises asyncio.TimeoutError if this takes longer than timeout seconds.
+        """
+        try:
+            await asyncio.wait_for(self.handshake(), timeout)
+        except BaseException:
+            # Timed out, cancelled or refused: don't leave a half-open socket
+            if self.writer:
+                self.writer.close()
+            raise
+
+        self.connected = True
+        self.closing = False
+        self.receive_task = asyncio.ensure_future(self.receive_messages())
+
+    async def handshake(self):
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        # Receive server's public key
+        handshake = await self.read_frame()
+        if handshake is None:
+            raise ConnectionError("Server closed the connection during handshake")
+        self.server_public_key, _ = handshake
+
+        # Send our public key to the server
+        self.writer.write(pickle.dumps(self.public_key))
+        await self.writer.drain()
+
+        # Prove we hold the private key by signing the server's challenge
+        challenge = await self.read_frame()
+        if challenge is None:
+            raise ConnectionError("Server closed the connection during handshake")
+        message = login_message(challenge[0]['nonce'], self.server_public_key, self.public_key)
+        self.writer.write(pickle.dumps({'type': 'challenge_response', 'signature': sign(message, self.private_key)}))
+        await self.writer.drain()
+
+    async def read_frame(self):
+        """Return the next (frame, size) pair, or None once the server has closed."""
+        while not self.pending:
+            data = await self.reader.read(self.bufsize)
+            if not data:
+                return None
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+    async def send(self, text):
+        """Encrypt text with the server's public key and send it."""
+        if not self.connected:
+            raise ConnectionError("Not connected to a server")
+        trace_id = None
+        if self.tracer is not None:
+            trace_id = secrets.token_hex(8)
+            composed_at = time.monotonic()
+            self.tracer.record(trace_id, 'client_compose', when=composed_at)
+        encrypted_message = encrypt_text(text, self.server_public_key)
+        message_data = {
+            'encrypted_message': encrypted_message
+        }
+        if trace_id is not None:
+            message_data['trace'] = (trace_id, composed_at)
+        frame = pickle.dumps(message_data)
+        if trace_id is not None:
+            self.tracer.record(trace_id, 'client_sent')
+        self.writer.write(frame)
+        await self.writer.drain()
+
+    async def send_frame(self, frame):
+        """Send a frame dict as is, without encrypting anything."""
+        if not self.connected:
+            raise ConnectionError("Not connected to a server")
+        self.writer.write(pickle.dumps(frame))
+        await self.writer.drain()
+
+    async def peer_key(self, client_id, timeout=10.0):
+        """Ask the server for another client's public key.
+
+        Raises LookupError if no client with that id is connected.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.key_requests.setdefault(client_id, []).append(future)
+        try:
+            await self.send_frame({'type': 'key_request', 'client_id': client_id})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiting = self.key_requests.get(client_id, [])
+            if future in waiting:
+                waiting.remove(future)
+
+    def resolve_key(self, frame):
+        client_id = frame.get('client_id')
+        public_key = frame.get('public_key')
+        for future in self.key_requests.pop(client_id, []):
+            if future.done():
+                continue
+            if public_key is None:
+                future.set_exception(LookupError(f"No client #{client_id} is connected"))
+            else:
+                future.set_result(public_key)
+
+    async def messages(self):
+        """Iterate over decrypted messages until the connection ends."""
+        queue = asyncio.Queue()
+        self.queues.append(queue)
+        try:
+            while self.connected or not queue.empty():
+                message = await queue.get()
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.queues.remove(queue)
+
+    async def receive_messages(self):
+        """Receive and decrypt messages and pass them to handlers and iterators."""
+        reason = "Server connection closed"
+        try:
+            while True:
+                frame = await self.read_frame()
+                if frame is None:
+                    break
+
+                message_data, _ = frame
+                frame_type = message_data.get('type')
+                if frame_type == 'ping':
+                    self.writer.write(PONG_FRAME)
+                    await self.writer.drain()
+                    continue
+                if frame_type == 'batch':
+                    # Several messages at once, e.g. those held while we were offline
+                    for encrypted_message in message_data.get('encrypted_messages', []):
+                        await self.dispatch(decrypt_text(encrypted_message, self.private_key))
+                    continue
+                if frame_type == 'key_response':
+                    self.resolve_key(message_data)
+                    continue
+                handler = self.frame_handlers.get(frame_type)
+                if handler is not None:
+                    result = handler(message_data)
+                    if inspect.isawaitable(result):
+                        await result
+                    continue
+                if 'encrypted_message' not in message_data:
+                    continue  # A frame type this client doesn't know about
+
+                trace_id = message_data.get('trace') if self.tracer is not None else None
+                if trace_id is not None:
+                    self.tracer.record(trace_id, 'recipient_receive', self.fingerprint)
+                encrypted_message = message_data.get('encrypted_message')
+                message = decrypt_text(encrypted_message, self.private_key)
+                await self.dispatch(message)
+                if trace_id is not None:
+                    self.tracer.record(trace_id, 'recipient_deliver', self.fingerprint)
+
+        except asyncio.CancelledError:
+            reason = None
+        except ConnectionResetError:
+            reason = "Server connection was reset"
+        except Exception as e:
+            reason = f"Error receiving: {e}"
+        finally:
+            await self.connection_lost(reason)
+
+    async def dispatch(self, message):
+        for handler in list(self.handlers):
+            result = handler(message)
+            if inspect.isawaitable(result):
+                await result
+        for queue in self.queues:
+            queue.put_nowait(message)
+
+    async def connection_lost(self, reason):
+        was_connected = self.connected
+        self.connected = False
+        for queue in self.queues:
+            queue.put_nowait(None)
+        for futures in self.key_requests.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed"))
+        self.key_requests.clear()
+
+        if self.writer:
+            self.writer.close()
+
+        if was_connected and not self.closing and reason is not None:
+            for handler in list(self.disconnect_handlers):
+                result = handler(reason)
+                if inspect.isawaitable(result):
+                    await result
+
+    async def close(self):
+        """Disconnect from the server."""
+        self.closing = True
+        current = asyncio.current_task()
+        if self.receive_task and not self.receive_task.done() and self.receive_task is not current:
+            self.receive_task.cancel()
+            try:
+                await self.receive_task
+            except asyncio.CancelledError:
+                pass
+        await self.connection_lost(None)
+        if self.writer:
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
@@ -1,17 +1,25 @@
 import tkinter as tk
-from tkinter import scrolledtext, messagebox, ttk
+from tkinter import scrolledtext, messagebox, ttk, filedialog, simpledialog
 import threading
-import socket
-import pickle
+import asyncio
+import concurrent.futures
+import time
 import sys
 import os
-from datetime import datetime
 
 # Import from the local rsa.py module
-from rsa import generate_keys, encrypt_text, decrypt_text
+from rsa import generate_keys
+from client_core import AsyncClient, load_or_create_keys
+from file_transfer import FileTransfers, MAX_FILE_SIZE, format_size
+from chat_view import ChatRenderQueue, DEFAULT_SCROLLBACK
+from tracing import LatencyTracer
+
+CONNECT_TIMEOUT = 10  # Seconds allowed for connect and key exchange
 
 class ChatClientGUI:
-    def __init__(self, root):
+    def __init__(self, root, scrollback=DEFAULT_SCROLLBACK, tracer=None, max_file_size=MAX_FILE_SIZE,
+                 key_file=None):
+        self.started = time.perf_counter()
         self.root = root
         self.root.title("Secure Chat Client")
         self.root.geometry("800x600")
@@ -20,19 +28,40 @@ class ChatClientGUI:
         # Client connection variables
         self.host = tk.StringVar(value="localhost")
         self.port = tk.IntVar(value=12345)
-        self.client_socket = None
+        self.client = None
+        self.transfers = None
+        self.max_file_size = max_file_size  # Bigger incoming files are refused without asking
+        self.tracer = tracer  # Optional LatencyTracer shared by every connection
+        self.key_file = key_file  # Keeps the same keys, and so held messages, between runs
         self.connected = False
+        self.connect_future = None
+        self.connect_started = None
         self.running = True
         
-        # Generate RSA keys
-        self.public_key, self.private_key = generate_keys(bit_length=512)
-        self.server_public_key = None
+        # Network I/O runs on an asyncio loop in a background thread
+        self.loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=self.loop.run_forever)
+        loop_thread.daemon = True
+        loop_thread.start()
         
         # Create GUI components
         self.create_widgets()
+        self.renderer = ChatRenderQueue(self.root, self.chat_display, max_lines=scrollback)
+        self.root.after_idle(self.on_first_paint)
+        
+        # Generate RSA keys in the background so the window appears straight away.
+        # Connecting stays disabled until they are ready.
+        self.public_key, self.private_key = None, None
+        self.keygen_ms = None
+        self.keys_ready = threading.Event()
+        key_thread = threading.Thread(target=self.generate_keys_in_background)
+        key_thread.daemon = True
+        key_thread.start()
         
         # Status updates
-        self.update_status("Disconnected", "red")
+        self.update_status("Generating keys...", "orange")
+        self.connect_btn.config(state=tk.DISABLED)
+        self.root.after(50, self.check_keys)
         
     def create_widgets(self):
         # Main frame
@@ -60,6 +89,11 @@ class ChatClientGUI:
         self.status_label = ttk.Label(conn_frame, text="Disconnected", foreground="red")
         self.status_label.grid(row=0, column=6, sticky=tk.W, padx=5)
         
+        # Progress indicator, only shown while connecting
+        self.progress = ttk.Progressbar(conn_frame, mode="indeterminate", length=80)
+        self.progress.grid(row=0, column=7, padx=5)
+        self.progress.grid_remove()
+        
         # Chat display
         chat_frame = ttk.Frame(main_frame)
         chat_frame.pack(fill=tk.BOTH, expand=True, pady=10)
@@ -77,27 +111,58 @@ class ChatClientGUI:
         self.message_input.bind("<Return>", self.send_message)
         self.message_input.config(state=tk.DISABLED)
         
+        self.file_btn = ttk.Button(input_frame, text="Send File...", command=self.send_file)
+        self.file_btn.pack(side=tk.RIGHT, padx=5)
+        self.file_btn.config(state=tk.DISABLED)
+        
         self.send_btn = ttk.Button(input_frame, text="Send", command=self.send_message)
         self.send_btn.pack(side=tk.RIGHT, padx=5)
         self.send_btn.config(state=tk.DISABLED)
     
     def update_status(self, status, color):
         self.status_label.config(text=status, foreground=color)
+    
+    def on_first_paint(self):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        self.append_message(f"Window ready in {elapsed:.0f} ms", "system")
+    
+    def generate_keys_in_background(self):
+        started = time.perf_counter()
+        self.public_key = None
+        if self.key_file:
+            try:
+                self.public_key, self.private_key = load_or_create_keys(self.key_file)
+            except (OSError, ValueError, KeyError) as e:
+                self.append_message(f"Could not use key file {self.key_file}: {e}; using new keys", "system")
+        if self.public_key is None:
+            self.public_key, self.private_key = generate_keys(bit_length=512)
+        self.keygen_ms = (time.perf_counter() - started) * 1000
+        self.keys_ready.set()
+    
+    def check_keys(self):
+        """Poll for the background key generation and enable Connect once done."""
+        if not self.keys_ready.is_set():
+            self.root.after(50, self.check_keys)
+            return
         
-    def append_message(self, message, tag=None):
-        self.chat_display.config(state=tk.NORMAL)
-        timestamp = datetime.now().strftime("[%H:%M:%S] ")
-        
-        # Insert timestamp
-        self.chat_display.insert(tk.END, timestamp, "timestamp")
+        self.append_message(f"Keys generated in {self.keygen_ms:.0f} ms", "system")
+        self.update_status("Disconnected", "red")
+        self.connect_btn.config(state=tk.NORMAL)
         
-        # Insert message with appropriate tag
-        self.chat_display.insert(tk.END, message + "\n", tag)
+    def append_message(self, message, tag=None):
+        """Queue a line for the chat display. Safe to call from any thread."""
+        self.renderer.put(message, tag)
         
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
+    def run_async(self, coro):
+        """Schedule a coroutine on the network loop and return its future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
         
     def connect_to_server(self):
+        if self.connect_future is not None:
+            # The button is a Cancel button while connecting
+            self.connect_future.cancel()
+            return
+        
         if self.connected:
             self.disconnect_from_server()
             return
@@ -105,82 +170,87 @@ class ChatClientGUI:
         try:
             host = self.host.get()
             port = self.port.get()
-            
-            # Create socket and connect
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((host, port))
-            self.connected = True
-            
-            # Update UI
-            self.update_status("Connected", "green")
-            self.connect_btn.config(text="Disconnect")
-            self.message_input.config(state=tk.NORMAL)
-            self.send_btn.config(state=tk.NORMAL)
-            
-            # Receive server's public key
-            server_public_key_data = self.client_socket.recv(4096)
-            self.server_public_key = pickle.loads(server_public_key_data)
-            
-            # Send our public key to the server
-            self.client_socket.send(pickle.dumps(self.public_key))
-            
-            # Display connection info
-            self.append_message(f"Connected to server at {host}:{port}", "system")
-            
-            # Start receiving messages
-            receive_thread = threading.Thread(target=self.receive_messages)
-            receive_thread.daemon = True
-            receive_thread.start()
-            
-        except Exception as e:
-            messagebox.showerror("Connection Error", f"Failed to connect: {str(e)}")
+        except tk.TclError as e:
+            messagebox.showerror("Connection Error", f"Invalid server address: {str(e)}")
+            return
+        
+        self.client = AsyncClient(host, port, keys=(self.public_key, self.private_key), tracer=self.tracer)
+        self.client.add_handler(self.on_message)
+        self.client.add_disconnect_handler(self.on_connection_lost)
+        self.transfers = FileTransfers(self.client, on_event=lambda text: self.append_message(text, "system"),
+                                       max_size=self.max_file_size, ask=self.ask_file)
+        
+        # Update UI
+        self.update_status("Connecting...", "orange")
+        self.connect_btn.config(text="Cancel")
+        self.progress.grid()
+        self.progress.start(10)
+        
+        # Connect and exchange keys on the network loop
+        self.connect_started = time.perf_counter()
+        self.connect_future = self.run_async(self.client.connect(timeout=CONNECT_TIMEOUT))
+        self.connect_future.add_done_callback(
+            lambda future: self.running and self.root.after(0, self.finish_connect, host, port, future)
+        )
+    
+    def finish_connect(self, host, port, future):
+        """Update the UI once a connection attempt succeeds, fails or is cancelled."""
+        self.connect_future = None
+        self.progress.stop()
+        self.progress.grid_remove()
+        self.connect_btn.config(text="Connect")
+        
+        if future.cancelled():
+            self.update_status("Disconnected", "red")
+            self.append_message("Connection cancelled", "system")
+            return
+        
+        error = future.exception()
+        if error is not None:
+            if isinstance(error, asyncio.TimeoutError):
+                error = f"timed out after {CONNECT_TIMEOUT} seconds"
+            messagebox.showerror("Connection Error", f"Failed to connect: {str(error)}")
             self.update_status("Error", "red")
+            return
+        
+        self.connected = True
+        elapsed = (time.perf_counter() - self.connect_started) * 1000
+        
+        # Update UI
+        self.update_status("Connected", "green")
+        self.connect_btn.config(text="Disconnect")
+        self.message_input.config(state=tk.NORMAL)
+        self.send_btn.config(state=tk.NORMAL)
+        self.file_btn.config(state=tk.NORMAL)
+        
+        # Display connection info
+        self.append_message(f"Connected to server at {host}:{port} in {elapsed:.0f} ms", "system")
             
     def disconnect_from_server(self):
         self.connected = False
         
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
+        if self.client:
+            self.run_async(self.client.close())
+        if self.transfers:
+            # Partly received files stay on disk so a re-send can resume them
+            self.loop.call_soon_threadsafe(self.transfers.close)
             
         # Update UI
         self.update_status("Disconnected", "red")
         self.connect_btn.config(text="Connect")
         self.message_input.config(state=tk.DISABLED)
         self.send_btn.config(state=tk.DISABLED)
+        self.file_btn.config(state=tk.DISABLED)
         self.append_message("Disconnected from server", "system")
         
-    def receive_messages(self):
-        """Receive and decrypt messages from the server."""
-        while self.running and self.connected:
-            try:
-                # Receive encrypted message from server
-                data = self.client_socket.recv(4096)
-                
-                if not data:
-                    if self.connected:
-                        self.root.after(0, self.handle_disconnect, "Server connection closed")
-                    break
-                
-                message_data = pickle.loads(data)
-                encrypted_message = message_data.get('encrypted_message')
-                
-                # Decrypt the message using our private key
-                decrypted_message = decrypt_text(encrypted_message, self.private_key)
-                
-                # Display the message
-                self.root.after(0, self.append_message, decrypted_message, "received")
-                
-            except ConnectionResetError:
-                if self.connected:
-                    self.root.after(0, self.handle_disconnect, "Server connection was reset")
-                break
-            except Exception as e:
-                if self.connected:
-                    self.root.after(0, self.handle_disconnect, f"Error receiving: {str(e)}")
-                break
+    def on_message(self, message):
+        """Display a decrypted message (called on the network loop)."""
+        self.append_message(message, "received")
+    
+    def on_connection_lost(self, reason):
+        """Report a lost connection (called on the network loop)."""
+        if self.connected:
+            self.root.after(0, self.handle_disconnect, reason)
     
     def handle_disconnect(self, message):
         """Handle disconnection with a message in the GUI thread"""
@@ -189,36 +259,73 @@ class ChatClientGUI:
     
     def send_message(self, event=None):
         """Send encrypted messages to the server."""
-        if not self.connected or not self.server_public_key:
+        if not self.connected or not self.client:
             return
         
         message = self.message_input.get().strip()
         if not message:
             return
         
-        try:
-            # Clear input field
-            self.message_input.delete(0, tk.END)
-            
-            # Display the message we're sending
-            self.append_message(f"You: {message}", "sent")
-            
-            # Encrypt message with server's public key
-            encrypted_message = encrypt_text(message, self.server_public_key)
-            message_data = {
-                'encrypted_message': encrypted_message
-            }
-            self.client_socket.send(pickle.dumps(message_data))
-            
-        except Exception as e:
-            messagebox.showerror("Send Error", f"Failed to send message: {str(e)}")
+        # Clear input field
+        self.message_input.delete(0, tk.END)
+        
+        # Display the message we're sending
+        self.append_message(f"You: {message}", "sent")
+        
+        # Encrypt and send on the network loop
+        future = self.run_async(self.client.send(message))
+        future.add_done_callback(self.on_send_done)
+    
+    def send_file(self):
+        """Pick a file and a recipient and send it in the background."""
+        if not self.connected or not self.transfers:
+            return
+        
+        path = filedialog.askopenfilename(title="Send File")
+        if not path:
+            return
+        client_id = simpledialog.askinteger("Send File", "Send to client #:", parent=self.root, minvalue=0)
+        if client_id is None:
+            return
+        
+        future = self.run_async(self.transfers.send_file(client_id, path))
+        future.add_done_callback(lambda future: self.on_file_done(future, path))
+    
+    async def ask_file(self, sender_id, name, size):
+        """Ask whether to receive a file (called on the network loop)."""
+        answer = concurrent.futures.Future()
+        question = f"Client #{sender_id} wants to send you {name} ({format_size(size)}). Accept it?"
+        self.root.after(0, lambda: answer.set_result(
+            self.running and messagebox.askyesno("Incoming File", question, parent=self.root)))
+        return await asyncio.wrap_future(answer)
+    
+    def on_file_done(self, future, path):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.append_message(f"Error sending {os.path.basename(path)}: {error}", "system")
+    
+    def on_send_done(self, future):
+        error = future.exception()
+        if error is not None:
+            self.root.after(0, self.handle_send_error, error)
+    
+    def handle_send_error(self, error):
+        messagebox.showerror("Send Error", f"Failed to send message: {str(error)}")
+        if self.connected:
             self.disconnect_from_server()
     
     def on_closing(self):
         """Handle window closing"""
         self.running = False
+        if self.connect_future is not None:
+            self.connect_future.cancel()
         if self.connected:
             self.disconnect_from_server()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.tracer is not None:
+            self.tracer.close()
         self.root.destroy()
 
 def main():
@@ -229,8 +336,22 @@ def main():
     style.configure("TButton", padding=6)
     style.configure("TLabel", padding=3)
     
+    # --trace-latency PATH logs traced messages for latency_report.py
+    tracer = None
+    if '--trace-latency' in sys.argv[1:-1]:
+        tracer = LatencyTracer(sys.argv[sys.argv.index('--trace-latency') + 1])
+    # --key-file PATH keeps the same keys between runs, so the server can
+    # hold messages for this client while it is offline
+    key_file = None
+    if '--key-file' in sys.argv[1:-1]:
+        key_file = sys.argv[sys.argv.index('--key-file') + 1]
+    # --max-file-size MB refuses bigger incoming files without asking
+    max_file_size = MAX_FILE_SIZE
+    if '--max-file-size' in sys.argv[1:-1]:
+        max_file_size = int(float(sys.argv[sys.argv.index('--max-file-size') + 1]) * 1024 * 1024)
+    
     # Create app
-    app = ChatClientGUI(root)
+    app = ChatClientGUI(root, tracer=tracer, max_file_size=max_file_size, key_file=key_file)
     
     # Set up text tags
     app.chat_display.tag_configure("timestamp", foreground="gray")
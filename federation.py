@@ -0,0 +1,289 @@
+import hashlib
+import hmac
+import itertools
+import pickle
+import secrets
+import socket
+import threading
+import time
+from collections import OrderedDict
+from rsa import encrypt_text, decrypt_text
+from protocol import FrameReader, PING_FRAME
+from rate_limit import RateLimiter
+
+# Seconds a node may take to complete the link handshake
+HANDSHAKE_TIMEOUT = 10.0
+
+class PeerLink:
+    """A connection to another server node."""
+    def __init__(self, peer_socket, reader, node_id, public_key, rate_buckets):
+        self.socket = peer_socket
+        self.reader = reader
+        self.node_id = node_id
+        self.public_key = public_key
+        self.rate_buckets = rate_buckets
+        self.send_lock = threading.Lock()
+
+    def send(self, data):
+        with self.send_lock:
+            self.socket.sendall(data)
+
+    def close(self):
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+class Federation:
+    """Relay client messages between server nodes so they form one chat.
+
+    Each node dials the peers in its list and also accepts links dialled
+    by others on its normal client port. A link starts like a client
+    connection, except the dialling node answers the server key with a
+    'peer_hello' frame instead of a bare public key. Both hellos carry a
+    fresh nonce, and each side proves it knows the shared secret with an
+    HMAC over both hellos before any relay frame is accepted, so the
+    secret itself never crosses the wire.
+
+    Frames on a link are charged to the link's own rate buckets, and when
+    heartbeats are on, each node pings its links and drops ones that stay
+    silent for the heartbeat timeout, like it does for clients.
+
+    Relayed messages carry an id made of the origin node, a random epoch
+    picked when the process starts and a counter, so a restarted node's
+    ids can't collide with ones its peers still remember, plus the list of nodes they have passed through. A node delivers and
+    forwards each id at most once and never forwards to a node already on
+    the path, so any topology, including a full mesh, is loop free.
+    """
+    def __init__(self, server, node_id, peers=(), secret=None, rate_limiter=None,
+                 reconnect_delay=2.0, seen_limit=100000):
+        if not secret:
+            raise ValueError("Linking nodes needs a shared link secret")
+        self.server = server
+        self.node_id = node_id
+        self.peers = list(peers)  # [(host, port)] to dial
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        # Links carry every client of the other node, so they get far more
+        # room than one client, but a misbehaving peer is still held back
+        self.rate_limiter = rate_limiter or RateLimiter(1000.0, 2000, 1024 * 1024, 4 * 1024 * 1024)
+        self.reconnect_delay = reconnect_delay
+        self.seen_limit = seen_limit
+        self.links = set()
+        self.seen = OrderedDict()  # Recently handled message ids, oldest first
+        self.lock = threading.Lock()
+        self.epoch = secrets.token_hex(8)
+        self.counter = itertools.count()
+
+    def hello(self, proof=None):
+        frame = {
+            'type': 'peer_hello',
+            'node_id': self.node_id,
+            'public_key': self.server.public_key,
+            'nonce': secrets.token_bytes(16),
+        }
+        if proof is not None:
+            frame['proof'] = proof
+        return frame
+
+    def proof(self, role, dial_hello, accept_hello):
+        """HMAC binding the secret to both hellos, so a proof can't be replayed on another link."""
+        fields = (role,
+                  dial_hello['node_id'], tuple(dial_hello['public_key']), dial_hello['nonce'],
+                  accept_hello['node_id'], tuple(accept_hello['public_key']), accept_hello['nonce'])
+        return hmac.new(self.secret, repr(fields).encode(), hashlib.sha256).digest()
+
+    def start(self):
+        """Start dialling the configured peers, and pinging links if heartbeats are on."""
+        for address in self.peers:
+            dial_thread = threading.Thread(target=self.dial, args=(address,))
+            dial_thread.daemon = True
+            dial_thread.start()
+        if self.server.heartbeat_interval:
+            self.server.timers.schedule(self.server.heartbeat_interval, self.schedule_pings)
+
+    def dial(self, address):
+        """Keep a link to one peer open, reconnecting whenever it drops."""
+        while self.server.running:
+            peer_socket = None
+            try:
+                # A peer that accepts but never answers mustn't hold this thread
+                peer_socket = socket.create_connection(address, timeout=HANDSHAKE_TIMEOUT)
+                reader = FrameReader(peer_socket)
+                handshake = reader.read()
+                if handshake is None:
+                    raise ConnectionError("peer closed the connection during handshake")
+                peer_public_key, _ = handshake
+                hello = self.hello()
+                peer_socket.sendall(pickle.dumps(hello))
+
+                # The accepting node answers with its own hello, which proves it has the secret
+                reply = reader.read()
+                accept_hello = check_hello(reply[0] if reply else None)
+                if tuple(accept_hello['public_key']) != tuple(peer_public_key):
+                    raise ConnectionError("peer sent a different key in its hello")
+                proof = accept_hello.get('proof')
+                if not (isinstance(proof, bytes)
+                        and hmac.compare_digest(proof, self.proof('accept', hello, accept_hello))):
+                    raise ConnectionError("peer does not know the link secret")
+                peer_socket.sendall(pickle.dumps({
+                    'type': 'peer_auth',
+                    'proof': self.proof('dial', hello, accept_hello),
+                }))
+
+                peer_socket.settimeout(None)
+                link = PeerLink(peer_socket, reader, accept_hello['node_id'], peer_public_key,
+                                self.rate_limiter.new_buckets())
+                self.server.emit('info', text=f"Linked to node {link.node_id} at {address[0]}:{address[1]}")
+                self.run_link(link)
+            except (OSError, ValueError) as e:
+                if self.server.running:
+                    self.server.emit('error', text=f"Could not link to peer {address[0]}:{address[1]}: {e}")
+                if peer_socket is not None:
+                    peer_socket.close()
+            time.sleep(self.reconnect_delay)
+
+    def accept(self, peer_socket, reader, hello):
+        """Serve a link dialled by another node. Called from a client handler thread."""
+        address = peer_socket.getpeername()[0]
+        try:
+            hello = check_hello(hello)
+            reply = self.hello()
+            reply['proof'] = self.proof('accept', hello, reply)
+            peer_socket.settimeout(HANDSHAKE_TIMEOUT)
+            peer_socket.sendall(pickle.dumps(reply))
+
+            auth = reader.read()
+            auth = auth[0] if auth else None
+            if not (isinstance(auth, dict) and auth.get('type') == 'peer_auth'
+                    and isinstance(auth.get('proof'), bytes)
+                    and hmac.compare_digest(auth['proof'], self.proof('dial', hello, reply))):
+                raise ConnectionError("it does not know the link secret")
+            peer_socket.settimeout(None)
+        except (OSError, ValueError) as e:
+            self.server.emit('error', text=f"Rejected link from {address}: {e}")
+            return
+
+        link = PeerLink(peer_socket, reader, hello['node_id'], tuple(hello['public_key']),
+                        self.rate_limiter.new_buckets())
+        self.server.emit('info', text=f"Node {link.node_id} linked from {address}")
+        self.run_link(link)
+
+    def run_link(self, link):
+        with self.lock:
+            self.links.add(link)
+        if self.server.heartbeat_interval:
+            # A link silent for this long is dead; the dialling side will redial
+            link.socket.settimeout(self.server.heartbeat_timeout)
+        try:
+            while self.server.running:
+                frame = link.reader.read()
+                if frame is None:
+                    break
+                message_data, size = frame
+                action = self.rate_limiter.admit(link.rate_buckets, size)
+                if action == 'drop':
+                    continue
+                if action == 'disconnect':
+                    self.server.emit('error', text=f"Node {link.node_id} exceeded the link rate limit")
+                    break
+                if not isinstance(message_data, dict) or message_data.get('type') != 'relay':
+                    continue  # Pings, or frames this node doesn't know
+
+                # One bad frame is dropped without taking the link down
+                try:
+                    self.receive(link, message_data)
+                except Exception as e:
+                    self.server.emit('error', text=f"Dropped bad frame from node {link.node_id}: {e}")
+        except (OSError, ValueError) as e:
+            self.server.emit('error', text=f"Link to node {link.node_id} failed: {e}")
+        finally:
+            with self.lock:
+                self.links.discard(link)
+            link.close()
+            self.server.emit('info', text=f"Link to node {link.node_id} closed")
+
+    def mark_seen(self, msg_id):
+        """Record msg_id, returning False if it has been handled before."""
+        with self.lock:
+            if msg_id in self.seen:
+                return False
+            self.seen[msg_id] = None
+            if len(self.seen) > self.seen_limit:
+                self.seen.popitem(last=False)
+            return True
+
+    def publish(self, message, sender_id):
+        """Relay a message from one of this node's clients to every peer."""
+        msg_id = f"{self.node_id}:{self.epoch}:{next(self.counter)}"
+        self.mark_seen(msg_id)
+        self.forward(message, msg_id, self.node_id, sender_id, [])
+
+    def receive(self, link, message_data):
+        msg_id = message_data.get('msg_id')
+        origin = message_data.get('origin')
+        sender_id = message_data.get('sender_id')
+        path = message_data.get('path')
+        if not (isinstance(msg_id, str) and isinstance(origin, str) and isinstance(sender_id, int)
+                and isinstance(path, list) and all(isinstance(node, str) for node in path)
+                and isinstance(message_data.get('encrypted_message'), int)):
+            raise ValueError("malformed relay frame")
+        if not self.mark_seen(msg_id):
+            return  # Already arrived over another link
+
+        message = decrypt_text(message_data['encrypted_message'], self.server.private_key)
+        self.server.emit('message', client_id=sender_id, origin=origin, text=message)
+        self.server.broadcast(message, sender_id=sender_id, origin=origin)
+        self.forward(message, msg_id, origin, sender_id, path)
+
+    def forward(self, message, msg_id, origin, sender_id, path):
+        path = path + [self.node_id]
+        with self.lock:
+            links = [link for link in self.links if link.node_id not in path]
+
+        for link in links:
+            message_data = {
+                'type': 'relay',
+                'msg_id': msg_id,
+                'origin': origin,
+                'sender_id': sender_id,
+                'path': path,
+                'encrypted_message': encrypt_text(message, link.public_key),
+            }
+            try:
+                link.send(pickle.dumps(message_data))
+            except OSError as e:
+                self.server.emit('error', text=f"Error relaying to node {link.node_id}: {e}")
+
+    def schedule_pings(self):
+        """Runs on the timer wheel; sending can block, so the pings go out on the pool."""
+        if not self.server.running:
+            return
+        self.server.worker_pool.submit(self.send_pings)
+        self.server.timers.schedule(self.server.heartbeat_interval, self.schedule_pings)
+
+    def send_pings(self):
+        with self.lock:
+            links = list(self.links)
+        for link in links:
+            try:
+                link.send(PING_FRAME)
+            except OSError:
+                link.close()  # Its reader notices and cleans up
+
+    def close(self):
+        with self.lock:
+            links = list(self.links)
+        for link in links:
+            link.close()
+
+def check_hello(hello):
+    """Return hello if it is a well-formed 'peer_hello' frame, else raise ValueError."""
+    if not (isinstance(hello, dict) and hello.get('type') == 'peer_hello'
+            and isinstance(hello.get('node_id'), str) and hello['node_id']
+            and isinstance(hello.get('nonce'), bytes) and len(hello['nonce']) >= 16):
+        raise ValueError("it sent a malformed hello")
+    public_key = hello.get('public_key')
+    if not (isinstance(public_key, (tuple, list)) and len(public_key) == 2
+            and all(isinstance(number, int) for number in public_key)):
+        raise ValueError("it sent a malformed public key")
+    return hello
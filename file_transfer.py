@@ -0,0 +1,406 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import inspect
+import os
+import re
+import secrets
+from rsa import encrypt_text, decrypt_text
+
+CHUNK_SIZE = 16 * 1024
+WINDOW = 8           # Chunks in flight before the sender waits for an ack
+ACK_TIMEOUT = 5.0    # Seconds without progress before chunks are resent
+OFFER_TIMEOUT = 120.0  # Seconds the recipient has to accept or refuse an offer
+MAX_RETRIES = 5
+MAX_CHUNK_SIZE = 1024 * 1024
+MAX_FILE_SIZE = 1024 * 1024 * 1024  # Default limit on incoming files
+DOWNLOAD_DIR = "downloads"
+
+def derive_keys(key):
+    """Split a transfer key into independent encryption and MAC keys."""
+    return hashlib.sha256(b"encrypt" + key).digest(), hashlib.sha256(b"mac" + key).digest()
+
+def chunk_nonce(transfer_id, index):
+    return transfer_id.encode() + index.to_bytes(8, 'big')
+
+def crypt_chunk(encryption_key, transfer_id, index, data):
+    """Encrypt or decrypt one chunk by XOR with a SHAKE-256 keystream.
+
+    The standard library has no block cipher, but an extendable-output hash
+    keyed by the transfer key and chunk number works as a stream cipher
+    and produces a whole chunk of keystream in a single call.
+    """
+    stream = hashlib.shake_256(encryption_key + chunk_nonce(transfer_id, index)).digest(len(data))
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(stream, 'big')).to_bytes(len(data), 'big')
+
+def chunk_mac(mac_key, transfer_id, index, ciphertext):
+    return hmac.new(mac_key, chunk_nonce(transfer_id, index) + ciphertext, hashlib.sha256).digest()
+
+def wrap_key(key, public_key):
+    # base64 keeps a 32 byte key to 44 characters, which fits one RSA block
+    return encrypt_text(base64.b64encode(key).decode('ascii'), public_key)
+
+def unwrap_key(wrapped_key, private_key):
+    return base64.b64decode(decrypt_text(wrapped_key, private_key))
+
+def file_digest(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size * 4), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def is_count(value, low=0, high=None):
+    """Whether value is an int (not a bool) between low and high."""
+    return (isinstance(value, int) and not isinstance(value, bool) and value >= low
+            and (high is None or value <= high))
+
+def is_transfer_id(value):
+    return isinstance(value, str) and re.fullmatch(r'[0-9a-f]{1,32}', value) is not None
+
+def check_offer(offer):
+    """Raise ValueError unless every field of a received offer is usable.
+
+    Everything in an offer comes from another client. The digest names the
+    .part file, so it has to be exactly a sha256 in hex.
+    """
+    name = offer.get('name')
+    if not isinstance(name, str) or os.path.basename(name) in ('', '.', '..'):
+        raise ValueError("bad file name")
+    if not is_count(offer.get('size')):
+        raise ValueError("bad file size")
+    if not is_count(offer.get('chunk_size'), 1, MAX_CHUNK_SIZE):
+        raise ValueError("bad chunk size")
+    if not isinstance(offer.get('digest'), str) or not re.fullmatch(r'[0-9a-f]{64}', offer['digest']):
+        raise ValueError("bad checksum")
+    if not is_count(offer.get('window', 1), 1):
+        raise ValueError("bad window")
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+class OutgoingTransfer:
+    """Sender side of one file: a sliding window of chunks with go-back-N resends."""
+    def __init__(self, transfer_id, recipient_id, path, chunk_size, window):
+        self.transfer_id = transfer_id
+        self.recipient_id = recipient_id
+        self.path = path
+        self.chunk_size = chunk_size
+        self.window = window
+        self.acked = None      # Chunks the recipient has, None until it answers the offer
+        self.error = None
+        self.progress = asyncio.Event()
+
+    def on_ack(self, next_index):
+        if self.acked is None or next_index > self.acked:
+            self.acked = next_index
+            self.progress.set()
+
+    def on_error(self, error):
+        self.error = error
+        self.progress.set()
+
+    async def wait(self, timeout=ACK_TIMEOUT):
+        """Wait for an ack or error, returning False on timeout."""
+        try:
+            await asyncio.wait_for(self.progress.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.progress.clear()
+        if self.error:
+            raise ConnectionError(self.error)
+        return True
+
+class IncomingTransfer:
+    """Receiver side of one file, written straight to a .part file on disk."""
+    def __init__(self, offer, key, download_dir):
+        self.transfer_id = offer['transfer_id']
+        self.sender_id = offer['from']
+        self.name = os.path.basename(offer['name'])
+        self.size = offer['size']
+        self.chunk_size = offer['chunk_size']
+        self.digest = offer['digest']
+        self.total = -(-self.size // self.chunk_size)
+        # Ack twice per sender window rather than every chunk
+        self.ack_every = max(1, offer.get('window', 1) // 2)
+        self.encryption_key, self.mac_key = derive_keys(key)
+        self.download_dir = download_dir
+
+        # Named after the content, so sending the same file again picks up
+        # where the last attempt stopped
+        self.part_path = os.path.join(download_dir, f".{self.digest[:16]}.part")
+        self.file = open(self.part_path, 'ab')
+        have = min(self.file.tell() // self.chunk_size, self.total)
+        self.file.truncate(have * self.chunk_size)
+        self.file.seek(have * self.chunk_size)
+        self.expected = have
+
+    def write(self, frame):
+        """Store a chunk if it is the next one in order. Returns False if it was ignored."""
+        index, ciphertext, mac = frame.get('index'), frame.get('data'), frame.get('mac')
+        if index != self.expected or not isinstance(ciphertext, bytes) or not isinstance(mac, bytes):
+            return False
+        if len(ciphertext) > self.chunk_size:
+            return False
+        if not hmac.compare_digest(mac, chunk_mac(self.mac_key, self.transfer_id, index, ciphertext)):
+            return False
+        self.file.write(crypt_chunk(self.encryption_key, self.transfer_id, index, ciphertext))
+        self.expected += 1
+        return True
+
+    def finish(self):
+        """Check the whole file against the sender's digest and move it into place."""
+        self.file.close()
+        if file_digest(self.part_path) != self.digest:
+            os.remove(self.part_path)
+            raise ValueError("file does not match the sender's checksum")
+
+        base, extension = os.path.splitext(self.name)
+        path = os.path.join(self.download_dir, self.name)
+        copy = 1
+        while os.path.exists(path):
+            path = os.path.join(self.download_dir, f"{base} ({copy}){extension}")
+            copy += 1
+        os.replace(self.part_path, path)
+        return path
+
+    def close(self):
+        self.file.close()
+
+class FileTransfers:
+    """Send and receive files over an AsyncClient connection.
+
+    A transfer starts with a 'file_offer' carrying a fresh random key wrapped
+    with the recipient's RSA key, followed by 'file_chunk' frames encrypted
+    with that key. The recipient answers every frame with a cumulative
+    'file_ack' naming the next chunk it wants. The server relays all of
+    these between the two clients without reading them.
+
+    At most window chunks are unacknowledged at any time, so chat messages
+    are never queued behind more than that. Only one chunk is held in
+    memory, whatever the file size. Incoming files are received into a
+    .part file named after their checksum, so re-sending a file after a
+    dropped connection resumes from the last acknowledged chunk.
+
+    Frames from other clients are checked field by field; malformed ones
+    are answered with 'file_error' or dropped. Offers over max_size are
+    refused, and nothing is written until ask(sender_id, name, size)
+    returns True. ask may be a coroutine function; without it every offer
+    is refused.
+
+    on_event(text) is called with progress lines for the front-end.
+    """
+    def __init__(self, client, download_dir=DOWNLOAD_DIR, on_event=print,
+                 chunk_size=CHUNK_SIZE, window=WINDOW, max_size=MAX_FILE_SIZE, ask=None):
+        self.client = client
+        self.download_dir = download_dir
+        self.on_event = on_event
+        self.chunk_size = chunk_size
+        self.window = window
+        self.max_size = max_size
+        self.ask = ask
+        self.outgoing = {}  # {transfer_id: OutgoingTransfer}
+        self.incoming = {}  # {transfer_id: IncomingTransfer}
+        self.asking = set()  # Offers waiting for ask()
+        client.add_frame_handler('file_offer', self.on_offer)
+        client.add_frame_handler('file_chunk', self.on_chunk)
+        client.add_frame_handler('file_ack', self.on_ack)
+        client.add_frame_handler('file_error', self.on_error)
+        client.add_disconnect_handler(lambda reason: self.close())
+
+    async def send_file(self, recipient_id, path):
+        """Send the file at path to another client and return once it has all of it."""
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        public_key = await self.client.peer_key(recipient_id)
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, file_digest, path)
+
+        key = secrets.token_bytes(32)
+        encryption_key, mac_key = derive_keys(key)
+        transfer = OutgoingTransfer(secrets.token_hex(8), recipient_id, path, self.chunk_size, self.window)
+        self.outgoing[transfer.transfer_id] = transfer
+        try:
+            await self.client.send_frame({
+                'type': 'file_offer',
+                'to': recipient_id,
+                'transfer_id': transfer.transfer_id,
+                'name': name,
+                'size': size,
+                'chunk_size': self.chunk_size,
+                'window': self.window,
+                'digest': digest,
+                'wrapped_key': wrap_key(key, public_key),
+            })
+            if not await transfer.wait(OFFER_TIMEOUT):
+                raise TimeoutError(f"Client #{recipient_id} did not answer the file offer")
+
+            total = -(-size // self.chunk_size)
+            if transfer.acked:
+                self.on_event(f"Resuming {name} at {format_size(transfer.acked * self.chunk_size)}")
+            else:
+                self.on_event(f"Sending {name} ({format_size(size)}) to Client #{recipient_id}")
+
+            with open(path, 'rb') as f:
+                await self.send_chunks(transfer, f, total, encryption_key, mac_key)
+            self.on_event(f"Sent {name} to Client #{recipient_id}")
+        finally:
+            del self.outgoing[transfer.transfer_id]
+
+    async def send_chunks(self, transfer, f, total, encryption_key, mac_key):
+        next_index = transfer.acked
+        retries = 0
+        while transfer.acked < total:
+            # Fill the window
+            while next_index < min(transfer.acked + transfer.window, total):
+                f.seek(next_index * transfer.chunk_size)
+                ciphertext = crypt_chunk(encryption_key, transfer.transfer_id, next_index,
+                                         f.read(transfer.chunk_size))
+                await self.client.send_frame({
+                    'type': 'file_chunk',
+                    'to': transfer.recipient_id,
+                    'transfer_id': transfer.transfer_id,
+                    'index': next_index,
+                    'data': ciphertext,
+                    'mac': chunk_mac(mac_key, transfer.transfer_id, next_index, ciphertext),
+                })
+                next_index += 1
+
+            acked = transfer.acked
+            if await transfer.wait():
+                if transfer.acked > acked:
+                    retries = 0
+                continue
+
+            # No progress: resend everything after the last ack
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise TimeoutError(f"Client #{transfer.recipient_id} stopped acknowledging chunks")
+            next_index = transfer.acked
+
+    async def send_ack(self, transfer):
+        await self.client.send_frame({
+            'type': 'file_ack',
+            'to': transfer.sender_id,
+            'transfer_id': transfer.transfer_id,
+            'next': transfer.expected,
+        })
+
+    async def send_error(self, frame, error):
+        await self.client.send_frame({
+            'type': 'file_error', 'to': frame['from'],
+            'transfer_id': frame['transfer_id'], 'error': error,
+        })
+
+    async def on_offer(self, offer):
+        # Without these there is nobody to answer
+        if not is_count(offer.get('from')) or not is_transfer_id(offer.get('transfer_id')):
+            return
+        try:
+            check_offer(offer)
+        except ValueError as e:
+            await self.send_error(offer, f"Invalid file offer: {e}")
+            return
+        name = os.path.basename(offer['name'])
+        if offer['size'] > self.max_size:
+            await self.send_error(offer, f"{name} is larger than the {format_size(self.max_size)} limit")
+            return
+
+        # Asking may take a while, so it mustn't hold up the connection's reader
+        task = asyncio.ensure_future(self.decide(offer, name))
+        self.asking.add(task)
+        task.add_done_callback(self.asking.discard)
+
+    async def decide(self, offer, name):
+        accepted = False
+        if self.ask is not None:
+            accepted = self.ask(offer['from'], name, offer['size'])
+            if inspect.isawaitable(accepted):
+                accepted = await accepted
+        if not accepted:
+            await self.send_error(offer, f"{name} was refused")
+            return
+
+        # A new offer for the same file replaces an attempt that stalled
+        for stale in [t for t in self.incoming.values() if t.digest == offer['digest']]:
+            stale.close()
+            del self.incoming[stale.transfer_id]
+
+        try:
+            key = unwrap_key(offer['wrapped_key'], self.client.private_key)
+            os.makedirs(self.download_dir, exist_ok=True)
+            transfer = IncomingTransfer(offer, key, self.download_dir)
+        except Exception as e:
+            await self.send_error(offer, f"Could not receive {name}: {e}")
+            return
+
+        self.incoming[transfer.transfer_id] = transfer
+        size = format_size(transfer.size)
+        if transfer.expected:
+            self.on_event(f"Resuming {name} ({size}) from Client #{transfer.sender_id}")
+        else:
+            self.on_event(f"Receiving {name} ({size}) from Client #{transfer.sender_id}")
+        await self.send_ack(transfer)
+        if transfer.expected == transfer.total:
+            await self.complete(transfer)
+
+    async def on_chunk(self, frame):
+        transfer = self.find(self.incoming, frame, 'sender_id')
+        if transfer is None:
+            return
+        # Out of order chunks are dropped and the ack repeated, so the sender goes back
+        stored = transfer.write(frame)
+        if transfer.expected == transfer.total:
+            await self.send_ack(transfer)
+            await self.complete(transfer)
+        elif not stored or transfer.expected % transfer.ack_every == 0:
+            await self.send_ack(transfer)
+
+    async def complete(self, transfer):
+        del self.incoming[transfer.transfer_id]
+        loop = asyncio.get_running_loop()
+        try:
+            path = await loop.run_in_executor(None, transfer.finish)
+        except Exception as e:
+            self.on_event(f"Failed to receive {transfer.name}: {e}")
+            return
+        self.on_event(f"Received {transfer.name} from Client #{transfer.sender_id}, saved to {path}")
+
+    def find(self, transfers, frame, peer):
+        """The transfer a frame belongs to, if it came from that transfer's other client."""
+        transfer_id = frame.get('transfer_id')
+        transfer = transfers.get(transfer_id) if is_transfer_id(transfer_id) else None
+        if transfer is None or frame.get('from') != getattr(transfer, peer):
+            return None
+        return transfer
+
+    def on_ack(self, frame):
+        transfer = self.find(self.outgoing, frame, 'recipient_id')
+        if transfer is not None and is_count(frame.get('next')):
+            transfer.on_ack(frame['next'])
+
+    def on_error(self, frame):
+        error = frame.get('error')
+        if not isinstance(error, str):
+            error = "Transfer failed"
+        transfer = self.find(self.outgoing, frame, 'recipient_id')
+        if transfer is not None:
+            transfer.on_error(error)
+            return
+        transfer = self.find(self.incoming, frame, 'sender_id')
+        if transfer is not None:
+            self.incoming.pop(transfer.transfer_id).close()
+
+    def close(self):
+        """Close partly received files; they are kept on disk for resuming."""
+        for task in self.asking:
+            task.cancel()
+        for transfer in self.incoming.values():
+            transfer.close()
+        self.incoming.clear()
+        for transfer in self.outgoing.values():
+            transfer.on_error("Connection closed")
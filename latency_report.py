@@ -0,0 +1,90 @@
+import argparse
+from collections import defaultdict
+from loadgen import percentile
+from tracing import read_events
+
+# (name, from event, to event, per recipient). Per-message hops are counted
+# once per traced message, the rest once per recipient it reached.
+HOPS = (
+    ("sender encrypt", 'client_compose', 'client_sent', False),
+    ("sender -> server", 'client_sent', 'server_receive', False),
+    ("server rate limit", 'server_receive', 'server_admit', False),
+    ("server decrypt", 'server_admit', 'server_decrypt', False),
+    ("server before fan-out", 'server_decrypt', 'server_fanout', False),
+    ("fan-out to recipient", 'server_fanout', 'server_send', True),
+    ("server -> recipient", 'server_send', 'recipient_receive', True),
+    ("recipient decrypt", 'recipient_receive', 'recipient_deliver', True),
+    ("end to end", 'client_compose', 'recipient_deliver', True),
+)
+PER_RECIPIENT = {'server_send', 'recipient_receive', 'recipient_deliver'}
+
+def load(paths):
+    """Merge trace files into {trace_id: {event: time}} and {trace_id: {peer: {event: time}}}.
+
+    If an event shows up in more than one file (the server also records the
+    sender's compose time from the frame) the earliest time is kept.
+    """
+    messages = defaultdict(dict)
+    recipients = defaultdict(lambda: defaultdict(dict))
+    for path in paths:
+        for when, _, trace_id, event, peer in read_events(path):
+            events = recipients[trace_id][peer] if event in PER_RECIPIENT else messages[trace_id]
+            if event not in events or when < events[event]:
+                events[event] = when
+    return messages, recipients
+
+def hop_times(messages, recipients):
+    """Latency samples in ms for every hop, and the end-to-end breakdown of each delivery."""
+    samples = {name: [] for name, _, _, _ in HOPS}
+    deliveries = []
+    for trace_id, events in messages.items():
+        for name, start, end, per_recipient in HOPS:
+            if not per_recipient and start in events and end in events:
+                samples[name].append((events[end] - events[start]) * 1000.0)
+
+        for peer, peer_events in recipients.get(trace_id, {}).items():
+            merged = dict(events, **peer_events)
+            breakdown = {}
+            for name, start, end, per_recipient in HOPS:
+                if per_recipient and start in merged and end in merged:
+                    breakdown[name] = (merged[end] - merged[start]) * 1000.0
+                    samples[name].append(breakdown[name])
+            if "end to end" in breakdown:
+                for name, start, end, per_recipient in HOPS:
+                    if not per_recipient and start in merged and end in merged:
+                        breakdown[name] = (merged[end] - merged[start]) * 1000.0
+                deliveries.append((breakdown["end to end"], trace_id, peer, breakdown))
+    return samples, deliveries
+
+def print_report(samples, deliveries, slowest):
+    print(f"{'hop':>22} {'count':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, _, _, _ in HOPS:
+        values = sorted(samples[name])
+        if not values:
+            print(f"{name:>22} {0:>7}")
+            continue
+        print(f"{name:>22} {len(values):>7} {percentile(values, 50):>8.2f} {percentile(values, 90):>8.2f} "
+              f"{percentile(values, 99):>8.2f} {values[-1]:>8.2f}")
+
+    if not deliveries:
+        print("No complete deliveries: give every process a trace file and pass them all in.")
+        return
+    deliveries.sort(key=lambda delivery: delivery[0], reverse=True)
+    print(f"\nSlowest {min(slowest, len(deliveries))} of {len(deliveries)} deliveries:")
+    for total, trace_id, peer, breakdown in deliveries[:slowest]:
+        hops = ", ".join(f"{name} {breakdown[name]:.2f}" for name, _, _, _ in HOPS[:-1] if name in breakdown)
+        print(f"  {trace_id} to {peer}: {total:.2f} ms ({hops})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge --trace-latency files into per-hop latency breakdowns.")
+    parser.add_argument('files', nargs='+', help="trace files from the server and the clients")
+    parser.add_argument('--slowest', type=int, default=5, help="slowest deliveries to break down one by one")
+    args = parser.parse_args()
+
+    messages, recipients = load(args.files)
+    samples, deliveries = hop_times(messages, recipients)
+    print(f"{len(messages)} traced messages in {len(args.files)} files")
+    print_report(samples, deliveries, args.slowest)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import selectors
+import socket
+import time
+
+# Linux silently caps this at net.core.somaxconn
+DEFAULT_BACKLOG = socket.SOMAXCONN
+
+class SocketOptions:
+    """Options applied to every accepted client socket.
+
+    Chat frames are small and latency matters more than packet count, so
+    Nagle's algorithm is off by default. Buffer sizes of None keep the
+    kernel defaults (and its autotuning).
+    """
+    def __init__(self, nodelay=True, keepalive=False, send_buffer=None, receive_buffer=None):
+        self.nodelay = nodelay
+        self.keepalive = keepalive
+        self.send_buffer = send_buffer
+        self.receive_buffer = receive_buffer
+
+    def apply(self, sock):
+        if self.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if self.send_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        if self.receive_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.receive_buffer)
+
+class Listener:
+    """Listening socket with an accept loop that drains the whole queue per wakeup.
+
+    serve() waits until the socket is readable, then accepts connections
+    until the kernel queue is empty (or max_batch is reached) and passes each
+    one to handle(client_socket, address) straight away. handle() must not
+    block; it is expected to hand the connection to a worker. A deep backlog
+    lets reconnect storms queue in the kernel instead of being dropped or
+    left retrying SYNs. close() may be called from any thread.
+    on_error(text) is told about connections that couldn't be accepted.
+    """
+    def __init__(self, host, port, backlog=DEFAULT_BACKLOG, options=None, max_batch=256, on_error=print):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.options = options or SocketOptions()
+        self.max_batch = max_batch
+        self.on_error = on_error
+        self.socket = None
+        self.selector = None
+        self.wakeup = None  # Socket pair used by close() to interrupt select()
+        self.running = False
+        self.accepted = 0
+
+    def open(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.socket.bind((self.host, self.port))
+            self.socket.listen(self.backlog)
+        except OSError:
+            self.socket.close()
+            raise
+        self.port = self.socket.getsockname()[1]
+        self.socket.setblocking(False)
+
+        self.wakeup = socket.socketpair()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.selector.register(self.wakeup[0], selectors.EVENT_READ)
+        self.running = True
+
+    def serve(self, handle):
+        """Accept connections until close() is called."""
+        try:
+            while self.running:
+                for key, _ in self.selector.select():
+                    if key.fileobj is self.socket:
+                        self.drain(handle)
+        finally:
+            self.selector.close()
+            for wakeup_socket in self.wakeup:
+                wakeup_socket.close()
+
+    def drain(self, handle):
+        for _ in range(self.max_batch):
+            try:
+                client_socket, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if not self.running:
+                    return
+                # Typically out of file descriptors: back off instead of spinning
+                self.on_error(f"Error accepting connection: {e}")
+                time.sleep(0.1)
+                return
+
+            self.accepted += 1
+            try:
+                client_socket.setblocking(True)
+                self.options.apply(client_socket)
+            except OSError as e:
+                self.on_error(f"Error configuring connection from {address}: {e}")
+                client_socket.close()
+                continue
+            handle(client_socket, address)
+
+    def close(self):
+        self.running = False
+        if self.wakeup:
+            try:
+                self.wakeup[1].send(b'\0')
+            except OSError:
+                pass
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import heapq
+import multiprocessing
+import queue
+import random
+import threading
+import time
+import uuid
+from client_core import AsyncClient
+from rsa import generate_keys
+
+KEY_BITS = 512
+# Broadcasts arrive as "Client #<id>: <text>" and the whole line has to fit in
+# a single RSA block of the recipient's key.
+LABEL_RESERVE = len("Client #000000: ")
+MAX_MESSAGE_SIZE = (KEY_BITS - 1) // 8 - LABEL_RESERVE
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+class Stats:
+    """Counters and latency samples collected by one worker."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connected = 0
+        self.sent = 0
+        self.received = 0
+        self.latencies = []  # milliseconds
+        self.errors = {'connect': 0, 'send': 0, 'disconnect': 0, 'decode': 0}
+
+    def record_delivery(self, latency_ms):
+        with self.lock:
+            self.received += 1
+            self.latencies.append(latency_ms)
+
+    def record_error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'connected': self.connected,
+                'sent': self.sent,
+                'received': self.received,
+                'latencies': list(self.latencies),
+                'errors': dict(self.errors),
+            }
+
+    def merge(self, data):
+        """Fold the as_dict() output of another worker into this one."""
+        with self.lock:
+            self.connected += data['connected']
+            self.sent += data['sent']
+            self.received += data['received']
+            self.latencies.extend(data['latencies'])
+            for kind, count in data['errors'].items():
+                self.errors[kind] = self.errors.get(kind, 0) + count
+
+class LatencyRecorder:
+    """Message handler that records the delivery latency of load messages."""
+    def __init__(self, marker, stats):
+        self.marker = marker
+        self.stats = stats
+
+    def __call__(self, message):
+        received_us = time.time_ns() // 1000
+        _, _, text = message.partition(": ")
+        if not text.startswith(self.marker):
+            return  # Join/leave notices and traffic from other runs
+        try:
+            sent_us = int(text.split(' ', 3)[2])
+        except (IndexError, ValueError):
+            self.stats.record_error('decode')
+            return
+        self.stats.record_delivery((received_us - sent_us) / 1000.0)
+
+def build_message(marker, seq, size):
+    """Build a load message carrying its send time, padded to size bytes."""
+    message = f"{marker}{seq} {time.time_ns() // 1000} "
+    return message + "." * (size - len(message))
+
+def run_worker(config, client_count, start_at, results):
+    """Drive client_count clients on one event loop and put the stats on results."""
+    stats = Stats()
+    asyncio.run(drive_clients(config, client_count, start_at, stats))
+    results.put(stats.as_dict())
+
+async def open_client(config, index, keys, recorder, stats):
+    host, port = config['servers'][index % len(config['servers'])]
+    client = AsyncClient(host, port, keys=keys)
+    client.add_handler(recorder)
+    client.add_disconnect_handler(lambda reason: stats.record_error('disconnect'))
+    try:
+        await client.connect(timeout=config['connect_timeout'])
+    except Exception:
+        stats.record_error('connect')
+        return None
+    return client
+
+async def drive_clients(config, client_count, start_at, stats):
+    keys = generate_keys(bit_length=KEY_BITS)
+    marker = f"~{config['run_id']} "
+    recorder = LatencyRecorder(marker, stats)
+
+    opened = await asyncio.gather(*(
+        open_client(config, i, keys, recorder, stats) for i in range(client_count)
+    ))
+    clients = [client for client in opened if client is not None]
+    stats.connected = len(clients)
+
+    # Wait for the other workers so every client is connected before traffic starts
+    await asyncio.sleep(max(start_at - time.time(), 0))
+    start = time.monotonic()
+    end = start + config['duration']
+    interval = 1.0 / config['rate']
+
+    # Stagger first sends across one interval so clients don't fire in lockstep
+    schedule = [(start + random.uniform(0, interval), i) for i in range(len(clients))]
+    heapq.heapify(schedule)
+    seq = 0
+
+    while schedule:
+        due, index = heapq.heappop(schedule)
+        if due >= end:
+            break
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        client = clients[index]
+        if client.connected:
+            try:
+                await client.send(build_message(marker, seq, config['size']))
+                stats.sent += 1
+                seq += 1
+            except Exception:
+                stats.record_error('send')
+                await client.close()
+        heapq.heappush(schedule, (due + interval, index))
+
+    # Give in-flight broadcasts time to arrive before hanging up
+    await asyncio.sleep(config['drain'])
+    await asyncio.gather(*(client.close() for client in clients))
+
+def parse_server(value):
+    host, _, port = value.rpartition(':')
+    return (host or 'localhost', int(port))
+
+def print_report(stats, config, elapsed):
+    latencies = sorted(stats.latencies)
+    expected = stats.sent * stats.connected
+
+    print(f"Clients:     {config['clients']} requested, {stats.connected} connected")
+    print(f"Messages:    {stats.sent} sent ({stats.sent / elapsed:.1f} msg/s)")
+    print(f"Deliveries:  {stats.received} of {expected} expected "
+          f"({stats.received / elapsed:.1f} msg/s)")
+    print(f"Latency ms:  p50 {percentile(latencies, 50):.2f}  "
+          f"p95 {percentile(latencies, 95):.2f}  "
+          f"p99 {percentile(latencies, 99):.2f}  "
+          f"max {latencies[-1] if latencies else 0.0:.2f}")
+    errors = ", ".join(f"{kind} {count}" for kind, count in sorted(stats.errors.items()))
+    print(f"Errors:      {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate chat load against a running server.")
+    parser.add_argument('--server', action='append', type=parse_server,
+                        help="host:port of a server, may be given more than once (default localhost:12345)")
+    parser.add_argument('--clients', type=int, default=10, help="number of headless clients")
+    parser.add_argument('--rate', type=float, default=1.0, help="messages per second per client")
+    parser.add_argument('--size', type=int, default=40, help=f"message size in bytes (max {MAX_MESSAGE_SIZE})")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of traffic")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker threads or processes")
+    parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--ramp', type=float, default=2.0, help="seconds allowed for clients to connect")
+    parser.add_argument('--drain', type=float, default=2.0, help="seconds to wait for late deliveries")
+    parser.add_argument('--connect-timeout', type=float, default=10.0,
+                        help="seconds before a connect or handshake counts as a connect error")
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:4]
+    min_size = len(build_message(f"~{run_id} ", 999999, 0))
+    if not min_size <= args.size <= MAX_MESSAGE_SIZE:
+        parser.error(f"--size must be between {min_size} and {MAX_MESSAGE_SIZE}")
+
+    config = {
+        'run_id': run_id,
+        'servers': args.server or [('localhost', 12345)],
+        'clients': args.clients,
+        'rate': args.rate,
+        'size': args.size,
+        'duration': args.duration,
+        'drain': args.drain,
+        'connect_timeout': args.connect_timeout,
+    }
+
+    if args.mode == 'process':
+        results = multiprocessing.Queue()
+        worker_type = multiprocessing.Process
+    else:
+        results = queue.Queue()
+        worker_type = threading.Thread
+
+    start_at = time.time() + args.ramp
+    workers = []
+    for i in range(args.workers):
+        count = args.clients // args.workers + (1 if i < args.clients % args.workers else 0)
+        worker = worker_type(target=run_worker, args=(config, count, start_at, results))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    stats = Stats()
+    for _ in workers:
+        stats.merge(results.get())
+    for worker in workers:
+        worker.join()
+
+    print_report(stats, config, args.duration)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import threading
+
+class PresenceDigest:
+    """Coalesce join and leave notices when many clients come and go at once.
+
+    Every notice costs one RSA encryption per connected client, so a
+    reconnect storm of N clients costs about N² encryptions. The first
+    threshold changes in each interval are still announced one by one.
+    Past that, changes are buffered and sent as a single digest line such as
+    "+37 joined, -5 left" at the end of the interval. A client that joins
+    and leaves within the same interval is not mentioned at all.
+    """
+    def __init__(self, timers, pool, broadcast, interval=1.0, threshold=10, on_error=print):
+        self.timers = timers        # TimerWheel that ends each interval
+        self.pool = pool            # Executor for digests, so the wheel never blocks
+        self.broadcast = broadcast  # Called with the text of each notice
+        self.interval = interval
+        self.threshold = threshold
+        self.on_error = on_error    # Called with the text of errors sending a digest
+        self.lock = threading.Lock()
+        self.window = None   # Timer ending the current interval, if one is open
+        self.announced = 0   # Individual notices sent in the current interval
+        self.pending = {}    # {client_id: True for a join, False for a leave}
+
+    def joined(self, client_id):
+        self.record(client_id, True, f"Client #{client_id} has joined the server!")
+
+    def left(self, client_id):
+        self.record(client_id, False, f"Client #{client_id} has left the server.")
+
+    def record(self, client_id, joined, notice):
+        if not self.interval:
+            self.broadcast(notice)
+            return
+
+        with self.lock:
+            if self.window is None:
+                self.window = self.timers.schedule(self.interval, self.end_window)
+            if self.announced < self.threshold:
+                self.announced += 1
+            else:
+                if not joined and self.pending.get(client_id):
+                    # Came and went before anyone was told
+                    del self.pending[client_id]
+                else:
+                    self.pending[client_id] = joined
+                notice = None
+
+        if notice:
+            self.broadcast(notice)
+
+    def end_window(self):
+        """Runs on the timer wheel thread at the end of each interval."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.announced = 0
+            if pending:
+                # Still busy, so keep coalescing for another interval
+                self.window = self.timers.schedule(self.interval, self.end_window)
+            else:
+                self.window = None
+        if pending:
+            self.pool.submit(self.send_digest, pending)
+
+    def send_digest(self, pending):
+        joins = sum(1 for joined in pending.values() if joined)
+        leaves = len(pending) - joins
+        parts = []
+        if joins:
+            parts.append(f"+{joins} joined")
+        if leaves:
+            parts.append(f"-{leaves} left")
+        try:
+            self.broadcast(", ".join(parts))
+        except Exception as e:
+            self.on_error(f"Error sending presence digest: {e}")
+
+    def close(self):
+        with self.lock:
+            if self.window is not None:
+                self.window.cancel()
+                self.window = None
+            self.pending.clear()
@@ -0,0 +1,190 @@
+import pickle
+import pickletools
+from collections import deque
+
+# Frames larger than this are treated as a corrupt stream rather than buffered
+MAX_FRAME_SIZE = 1024 * 1024
+
+# Heartbeat frames. Chat frames carry 'encrypted_message' and no 'type'.
+PING_FRAME = pickle.dumps({'type': 'ping'})
+PONG_FRAME = pickle.dumps({'type': 'pong'})
+
+# Frames the server passes from one client to another without reading them.
+# The sender names the recipient's client id in 'to' and the server replaces
+# it with 'from'. See file_transfer.py.
+RELAY_FRAME_TYPES = frozenset(('file_offer', 'file_chunk', 'file_ack', 'file_error'))
+
+def login_message(nonce, server_public_key, client_public_key):
+    """What a client signs to prove it holds the private key for the key it sent.
+
+    Naming both keys stops a signature made for one server from being
+    replayed to another.
+    """
+    return f"chat-login:{nonce.hex()}:{server_public_key}:{client_public_key}".encode()
+
+# Argument size of every pickle opcode: a fixed byte count, or one of the
+# pickletools markers for newline-terminated and length-prefixed arguments
+_ARG_SIZES = {ord(op.code): op.arg.n if op.arg else 0 for op in pickletools.opcodes}
+_LENGTH_FIELDS = {  # {marker: (bytes in the length field, signed)}
+    pickletools.TAKEN_FROM_ARGUMENT1: (1, False),
+    pickletools.TAKEN_FROM_ARGUMENT4: (4, True),
+    pickletools.TAKEN_FROM_ARGUMENT4U: (4, False),
+    pickletools.TAKEN_FROM_ARGUMENT8U: (8, False),
+}
+# Opcodes that look up or call globals or persistent ids. pickle.loads
+# would run code named by the peer, before it has proved anything, and
+# frames only ever hold dicts, lists, tuples, str, bytes and numbers.
+_UNSAFE_OPCODES = {ord(op.code) for op in pickletools.opcodes if op.name in (
+    'GLOBAL', 'STACK_GLOBAL', 'INST', 'OBJ', 'NEWOBJ', 'NEWOBJ_EX', 'REDUCE', 'BUILD',
+    'EXT1', 'EXT2', 'EXT4', 'PERSID', 'BINPERSID')}
+_STOP = ord('.')
+
+class FrameDecoder:
+    """Split a TCP byte stream back into the pickled frames that were sent.
+
+    TCP does not keep message boundaries, so one recv() can hold several
+    frames or only part of one. Bytes are buffered until a whole frame is
+    available. The end of a frame is found by stepping over its opcodes,
+    skipping length-prefixed arguments such as ciphertexts in one go, and
+    the step position is kept between calls. Each byte is looked at once
+    and each frame unpickled once, however many reads it arrives in.
+    Frames holding opcodes that reach globals are refused before they are
+    unpickled.
+    """
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+        self.scanned = 0  # Offset of the first opcode of the partial frame not yet stepped over
+
+    def feed(self, data):
+        """Add received bytes and return a list of complete (frame, size) pairs."""
+        self.buffer += data
+        frames = []
+        while True:
+            end = self.frame_end()
+            if end is None:
+                break
+            frame = pickle.loads(self.buffer[:end])
+            del self.buffer[:end]
+            self.scanned = 0
+            frames.append((frame, end))
+
+        if len(self.buffer) > self.max_frame_size:
+            raise ValueError("Incoming frame exceeds maximum frame size")
+        return frames
+
+    def frame_end(self):
+        """Length of the first frame in the buffer, or None if it hasn't all arrived."""
+        buffer = self.buffer
+        position = self.scanned
+        while position < len(buffer):
+            code = buffer[position]
+            if code == _STOP:
+                return position + 1
+            size = _ARG_SIZES.get(code)
+            if size is None:
+                raise ValueError(f"Corrupt frame: unknown pickle opcode {code:#04x}")
+            if code in _UNSAFE_OPCODES:
+                raise ValueError(f"Refused frame: pickle opcode {code:#04x} can run code")
+
+            end = position + 1
+            if size >= 0:
+                end += size
+            elif size == pickletools.UP_TO_NEWLINE:
+                newline = buffer.find(b'\n', end)
+                if newline < 0:
+                    break
+                end = newline + 1
+            else:
+                width, signed = _LENGTH_FIELDS[size]
+                if end + width > len(buffer):
+                    break
+                length = int.from_bytes(buffer[end:end + width], 'little', signed=signed)
+                if length < 0:
+                    raise ValueError("Corrupt frame: negative argument length")
+                end += width + length
+
+            if end > self.max_frame_size:
+                raise ValueError("Incoming frame exceeds maximum frame size")
+            if end > len(buffer):
+                break
+            position = end
+
+        self.scanned = position
+        return None
+
+class FrameReader:
+    """Read whole frames from a blocking socket."""
+    def __init__(self, sock, bufsize=4096):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.decoder = FrameDecoder()
+        self.pending = deque()
+
+    def read(self):
+        """Return the next (frame, size) pair, or None once the peer has closed."""
+        while not self.pending:
+            data = self.sock.recv(self.bufsize)
+            if not data:
+                return None
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+# Pickle opcodes used to build chat frames by hand (protocol 2)
+_PROTO_2 = b'\x80\x02'
+_EMPTY_DICT = b'}'
+_MARK = b'('
+_BINUNICODE = b'X'
+_LONG1 = b'\x8a'
+_LONG4 = b'\x8b'
+_SETITEMS_STOP = 0x2e75  # b'u.' read as a little-endian integer
+
+def _pickle_str(text):
+    data = text.encode('utf-8')
+    return _BINUNICODE + len(data).to_bytes(4, 'little') + data
+
+class FrameTemplate:
+    """Chat frame whose string fields are serialized once and reused.
+
+    A frame is a pickled dict of string fields plus 'encrypted_message'.
+    Only the ciphertext differs between the recipients of a broadcast, so
+    everything before it is built once (per ciphertext length, which is
+    nearly always the same for one key size) and joined to the ciphertext
+    bytes, instead of building a dict and calling pickle.dumps() per
+    recipient. The result is an ordinary pickle that pickle.loads() and
+    FrameDecoder read back as the same dict.
+
+    The frame goes out as one buffer with sendall(). Writing head and
+    payload with a vectored sendmsg() measured slower: for two short
+    buffers its per-call overhead costs more than copying the head.
+    """
+    def __init__(self, fields):
+        parts = [_PROTO_2, _EMPTY_DICT, _MARK]
+        for key, value in fields.items():
+            parts.append(_pickle_str(key))
+            parts.append(_pickle_str(value))
+        parts.append(_pickle_str('encrypted_message'))
+        self.prefix = b''.join(parts)
+        self.heads = {}  # {payload length: prefix + integer opcode and length}
+
+    def buffers(self, ciphertext):
+        """Return the (shared head, payload) buffers of the frame for one ciphertext."""
+        # Same layout as pickle's LONG1/LONG4: little-endian two's complement
+        # with room for the sign bit. The closing opcodes ride along in the
+        # top two bytes so the payload is a single allocation.
+        size = (ciphertext.bit_length() >> 3) + 1
+        payload = (ciphertext | (_SETITEMS_STOP << (8 * size))).to_bytes(size + 2, 'little')
+
+        head = self.heads.get(size)
+        if head is None:
+            if size < 256:
+                head = self.prefix + _LONG1 + bytes([size])
+            else:
+                head = self.prefix + _LONG4 + size.to_bytes(4, 'little')
+            self.heads[size] = head
+        return head, payload
+
+    def frame(self, ciphertext):
+        """Return the whole frame for one ciphertext as a single bytes object."""
+        head, payload = self.buffers(ciphertext)
+        return head + payload
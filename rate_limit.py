@@ -0,0 +1,93 @@
+import threading
+import time
+
+POLICIES = ('delay', 'drop', 'disconnect')
+
+class TokenBucket:
+    """Allow rate units per second on average, with bursts of up to capacity."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount tokens are available (0 if they are now)."""
+        self.refill()
+        # A request bigger than the bucket only has to wait for a full bucket
+        deficit = min(amount, self.capacity) - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def consume(self, amount):
+        # Oversized requests leave the bucket in debt, which keeps the
+        # long-run average at rate
+        self.tokens -= amount
+
+class RateLimiter:
+    """Per-client message and byte limits with a server-wide policy.
+
+    Every session gets its own pair of buckets from new_buckets(). admit()
+    is called for each incoming frame before any decryption, and either lets
+    it through (after sleeping, for the 'delay' policy) or returns the
+    action the server should take: 'drop' or 'disconnect'.
+    A rate of 0 turns that limit off.
+    """
+    def __init__(self, messages_per_second=5.0, message_burst=20,
+                 bytes_per_second=64 * 1024, byte_burst=256 * 1024, policy='delay'):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown rate limit policy: {policy}")
+        self.messages_per_second = messages_per_second
+        self.message_burst = message_burst
+        self.bytes_per_second = bytes_per_second
+        self.byte_burst = byte_burst
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.counters = {'allowed': 0, 'delayed': 0, 'dropped': 0, 'disconnected': 0}
+
+    def new_buckets(self):
+        """Return the (messages, bytes) buckets for a new session."""
+        message_bucket = None
+        byte_bucket = None
+        if self.messages_per_second:
+            message_bucket = TokenBucket(self.messages_per_second, self.message_burst)
+        if self.bytes_per_second:
+            byte_bucket = TokenBucket(self.bytes_per_second, self.byte_burst)
+        return message_bucket, byte_bucket
+
+    def admit(self, buckets, size):
+        """Charge one frame of size bytes. Returns None if it may be processed."""
+        message_bucket, byte_bucket = buckets
+        wait = 0.0
+        if message_bucket:
+            wait = message_bucket.wait_time(1)
+        if byte_bucket:
+            wait = max(wait, byte_bucket.wait_time(size))
+
+        if wait > 0:
+            if self.policy != 'delay':
+                self.count('dropped' if self.policy == 'drop' else 'disconnected')
+                return self.policy
+            # Stalling this client's reader pushes back on it through TCP
+            time.sleep(wait)
+            self.count('delayed')
+        else:
+            self.count('allowed')
+
+        if message_bucket:
+            message_bucket.consume(1)
+        if byte_bucket:
+            byte_bucket.consume(size)
+        return None
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import time
+import uuid
+from client_core import AsyncClient
+from rsa import generate_keys
+from capture import read_trace, CONNECT, MESSAGE, DISCONNECT
+from loadgen import KEY_BITS, MAX_MESSAGE_SIZE, Stats, LatencyRecorder, build_message, parse_server, percentile
+
+class Replayer:
+    """Re-drive a captured trace against a server with headless clients.
+
+    Every client id in the trace gets its own AsyncClient, which connects,
+    sends messages of the recorded sizes and disconnects at the recorded
+    times divided by speed. Messages carry their send time like loadgen's,
+    so delivery latency is measured the same way.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.stats = Stats()
+        self.keys = generate_keys(bit_length=KEY_BITS)
+        self.marker = f"~{uuid.uuid4().hex[:4]} "
+        self.recorder = LatencyRecorder(self.marker, self.stats)
+        self.min_size = len(build_message(self.marker, 999999, 0))
+        self.clients = {}   # {trace client id: task that connects its AsyncClient}
+        self.tasks = set()  # Sends and closes that haven't finished yet
+        self.seq = 0
+        self.expected = 0   # Deliveries we should see if nothing is lost
+        self.resized = 0    # Messages that had to be padded or cut to fit
+        self.late = []      # How far behind the schedule each event ran, in ms
+
+    async def open_client(self, index):
+        host, port = self.config['servers'][index % len(self.config['servers'])]
+        client = AsyncClient(host, port, keys=self.keys)
+        client.add_handler(self.recorder)
+        client.add_disconnect_handler(lambda reason: self.stats.record_error('disconnect'))
+        try:
+            await client.connect(timeout=self.config['connect_timeout'])
+        except Exception:
+            self.stats.record_error('connect')
+            return None
+        self.stats.connected += 1
+        return client
+
+    def connected_count(self):
+        count = 0
+        for task in self.clients.values():
+            if task.done() and task.result() is not None and task.result().connected:
+                count += 1
+        return count
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def send(self, connecting, size):
+        client = await connecting
+        if client is None or not client.connected:
+            return
+        self.expected += self.connected_count()
+        try:
+            await client.send(build_message(self.marker, self.seq, size))
+            self.stats.sent += 1
+            self.seq += 1
+        except Exception:
+            self.stats.record_error('send')
+
+    async def close(self, connecting):
+        client = await connecting
+        if client is not None:
+            await client.close()
+
+    async def run(self):
+        speed = self.config['speed']
+        start = time.monotonic()
+        trace_end = 0.0
+
+        for kind, seconds, client_id, frame_size, text_length in read_trace(self.config['trace']):
+            trace_end = seconds
+            delay = start + seconds / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.late.append(-delay * 1000.0)
+
+            if kind == CONNECT:
+                task = asyncio.ensure_future(self.open_client(len(self.clients)))
+                self.clients[client_id] = task
+            elif kind == MESSAGE and client_id in self.clients:
+                size = min(max(text_length, self.min_size), MAX_MESSAGE_SIZE)
+                if size != text_length:
+                    self.resized += 1
+                self.spawn(self.send(self.clients[client_id], size))
+            elif kind == DISCONNECT and client_id in self.clients:
+                self.spawn(self.close(self.clients.pop(client_id)))
+
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+        elapsed = time.monotonic() - start
+
+        # Give in-flight broadcasts time to arrive before hanging up
+        await asyncio.sleep(self.config['drain'])
+        remaining = await asyncio.gather(*self.clients.values())
+        await asyncio.gather(*(client.close() for client in remaining if client is not None))
+        return trace_end, elapsed
+
+    def print_report(self, trace_end, elapsed):
+        stats = self.stats
+        latencies = sorted(stats.latencies)
+        late = sorted(self.late)
+        elapsed = max(elapsed, 1e-9)
+
+        print(f"Trace:       {trace_end:.1f}s replayed in {elapsed:.1f}s (x{self.config['speed']:g})")
+        print(f"Clients:     {stats.connected} connected")
+        print(f"Messages:    {stats.sent} sent ({stats.sent / elapsed:.1f} msg/s), "
+              f"{self.resized} resized to fit")
+        print(f"Deliveries:  {stats.received} of {self.expected} expected "
+              f"({stats.received / elapsed:.1f} msg/s)")
+        print(f"Latency ms:  p50 {percentile(latencies, 50):.2f}  "
+              f"p95 {percentile(latencies, 95):.2f}  "
+              f"p99 {percentile(latencies, 99):.2f}  "
+              f"max {latencies[-1] if latencies else 0.0:.2f}")
+        if late:
+            print(f"Behind ms:   p50 {percentile(late, 50):.2f}  p99 {percentile(late, 99):.2f}  "
+                  f"({len(late)} events fired late)")
+        errors = ", ".join(f"{kind} {count}" for kind, count in sorted(stats.errors.items()))
+        print(f"Errors:      {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a trace captured with server_cli.py --capture.")
+    parser.add_argument('trace', help="trace file to replay")
+    parser.add_argument('--server', action='append', type=parse_server,
+                        help="host:port of a server, may be given more than once (default localhost:12345)")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay speed, e.g. 10 replays an hour of traffic in six minutes")
+    parser.add_argument('--drain', type=float, default=2.0, help="seconds to wait for late deliveries")
+    parser.add_argument('--connect-timeout', type=float, default=10.0,
+                        help="seconds before a connect or handshake counts as a connect error")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    config = {
+        'trace': args.trace,
+        'servers': args.server or [('localhost', 12345)],
+        'speed': args.speed,
+        'drain': args.drain,
+        'connect_timeout': args.connect_timeout,
+    }
+    replayer = Replayer(config)
+    trace_end, elapsed = asyncio.run(replayer.run())
+    replayer.print_report(trace_end, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,116 @@
+import hashlib
 import random
 import math
 
-def is_prime(n, k=5):
-    if n < 2:
-        return False
-    
-    small_primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
-    for p in small_primes:
-        if n == p:
-            return True
-        if n % p == 0:
-            return False
-    
-    r, d = 0, n - 1
-    while d % 2 == 0:
-        r += 1
-        d //= 2
-    
-    for _ in range(k):
-        a = random.randrange(2, n - 1)
-        x = pow(a, d, n)
-        if x == 1 or x == n - 1:
-            continue
-        for _ in range(r - 1):
-            x = pow(x, 2, n)
-            if x == n - 1:
-                break
-        else:
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+class PythonBackend:
+    """Modular arithmetic on plain Python ints."""
+    name = 'python'
+
+    def powmod(self, base, exponent, modulus):
+        return pow(base, exponent, modulus)
+
+    def invert(self, a, m):
+        g, x, _ = egcd(a, m)
+        if g != 1:
+            raise Exception('Modular inverse does not exist')
+        return x % m
+
+    def is_prime(self, n, k=5):
+        if n < 2:
             return False
-    return True
 
-def generate_prime(bit_length):
+        small_primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+        for p in small_primes:
+            if n == p:
+                return True
+            if n % p == 0:
+                return False
+
+        r, d = 0, n - 1
+        while d % 2 == 0:
+            r += 1
+            d //= 2
+
+        for _ in range(k):
+            a = random.randrange(2, n - 1)
+            x = pow(a, d, n)
+            if x == 1 or x == n - 1:
+                continue
+            for _ in range(r - 1):
+                x = pow(x, 2, n)
+                if x == n - 1:
+                    break
+            else:
+                return False
+        return True
+
+class Gmpy2Backend:
+    """Modular arithmetic in GMP through gmpy2.
+
+    Results are converted back to int, since keys and ciphertexts are pickled
+    to clients that may not have gmpy2 installed.
+    """
+    name = 'gmpy2'
+
+    def powmod(self, base, exponent, modulus):
+        return int(gmpy2.powmod(base, exponent, modulus))
+
+    def invert(self, a, m):
+        try:
+            return int(gmpy2.invert(a, m))
+        except ZeroDivisionError:
+            raise Exception('Modular inverse does not exist')
+
+    def is_prime(self, n, k=5):
+        return bool(gmpy2.is_prime(n, k))
+
+BACKENDS = {'python': PythonBackend}
+if gmpy2 is not None:
+    BACKENDS['gmpy2'] = Gmpy2Backend
+
+# The fastest available backend; set_backend() overrides it
+backend = Gmpy2Backend() if gmpy2 is not None else PythonBackend()
+
+def set_backend(name):
+    """Switch every RSA operation to the named backend ('python' or 'gmpy2')."""
+    global backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown or unavailable RSA backend: {name}")
+    backend = BACKENDS[name]()
+
+def is_prime(n, k=5):
+    return backend.is_prime(n, k)
+
+def generate_prime(bit_length, rng=random):
+    # Candidates come from rng only, never from the primality test, so a
+    # seeded rng gives the same candidates with every backend
     while True:
-        p = random.getrandbits(bit_length) | (1 << (bit_length - 1)) | 1
+        p = rng.getrandbits(bit_length) | (1 << (bit_length - 1)) | 1
         if is_prime(p):
             return p
 
 def egcd(a, b):
-    if b == 0:
-        return a, 1, 0
-    g, x1, y1 = egcd(b, a % b)
-    x = y1
-    y = x1 - (a // b) * y1
-    return g, x, y
+    # Iterative, so large keys can't hit the recursion limit
+    x0, y0, x1, y1 = 1, 0, 0, 1
+    while b:
+        q, a, b = a // b, b, a % b
+        x0, x1 = x1, x0 - q * x1
+        y0, y1 = y1, y0 - q * y1
+    return a, x0, y0
 
 def modinv(a, m):
-    g, x, _ = egcd(a, m)
-    if g != 1:
-        raise Exception('Modular inverse does not exist')
-    return x % m
-
-def generate_keys(bit_length=1024):
-    p = generate_prime(bit_length // 2)
-    q = generate_prime(bit_length // 2)
+    return backend.invert(a, m)
+
+def generate_keys(bit_length=1024, rng=random):
+    p = generate_prime(bit_length // 2, rng)
+    q = generate_prime(bit_length // 2, rng)
     while q == p:
-        q = generate_prime(bit_length // 2)
+        q = generate_prime(bit_length // 2, rng)
     
     n = p * q
     phi = (p - 1) * (q - 1)
@@ -80,8 +136,23 @@ def encrypt_text(message, public_key):
     e, n = public_key
     if message_int >= n:
         raise ValueError('Message too long for encryption key size')
-    return pow(message_int, e, n)
+    return backend.powmod(message_int, e, n)
 
 def decrypt_text(ciphertext, private_key):
-    decrypted_int = pow(ciphertext, private_key[0], private_key[1])
+    decrypted_int = backend.powmod(ciphertext, private_key[0], private_key[1])
     return int_to_text(decrypted_int)
+
+def digest_to_int(data, n):
+    # sha256 of data, reduced below the modulus so it can be signed
+    return int.from_bytes(hashlib.sha256(data).digest(), byteorder='big') % n
+
+def sign(data, private_key):
+    d, n = private_key
+    return backend.powmod(digest_to_int(data, n), d, n)
+
+def verify(data, signature, public_key):
+    """Whether signature was made over data with the private half of public_key."""
+    e, n = public_key
+    if not isinstance(signature, int) or not 0 <= signature < n:
+        return False
+    return backend.powmod(signature, e, n) == digest_to_int(data, n)
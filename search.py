@@ -0,0 +1,187 @@
+import bisect
+import re
+import threading
+import time
+from array import array
+
+TOKEN = re.compile(r"\w+")
+DURATION = re.compile(r"^(\d+)([smhd])$")
+CLOCK = re.compile(r"^(\d{1,2}):(\d{2})$")
+UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def tokenize(text):
+    """Distinct lowercase words of text, in order."""
+    return list(dict.fromkeys(TOKEN.findall(text.lower())))
+
+def parse_time(value, now):
+    """A wall-clock time from '10m' (that long ago) or '14:30' (today)."""
+    match = DURATION.match(value)
+    if match:
+        return now - int(match.group(1)) * UNIT_SECONDS[match.group(2)]
+    match = CLOCK.match(value)
+    if match:
+        day = time.localtime(now)
+        return time.mktime((day.tm_year, day.tm_mon, day.tm_mday,
+                            int(match.group(1)), int(match.group(2)), 0, 0, 0, -1))
+    raise ValueError(f"Can't read time '{value}', use e.g. 30m, 2h or 14:30")
+
+def parse_query(query, now=None):
+    """Split '/search' arguments into (terms, since, until).
+
+    Words are ANDed together; 'since:' and 'until:' take a duration ago
+    or a time of day.
+    """
+    now = time.time() if now is None else now
+    terms, since, until = [], None, None
+    for word in query.split():
+        key, _, value = word.partition(':')
+        if key == 'since' and value:
+            since = parse_time(value, now)
+        elif key == 'until' and value:
+            until = parse_time(value, now)
+        else:
+            terms.extend(tokenize(word))
+    if not terms and since is None and until is None:
+        raise ValueError("Usage: /search <words> [since:30m] [until:14:30]")
+    return list(dict.fromkeys(terms)), since, until
+
+class Posting:
+    """Ascending message ids for one term, trimmed from the front as messages expire."""
+    __slots__ = ('term', 'ids', 'start')
+
+    def __init__(self, term):
+        self.term = term
+        self.ids = array('q')
+        self.start = 0  # Ids before this index have been evicted
+
+    def __len__(self):
+        return len(self.ids) - self.start
+
+    def pop_front(self):
+        self.start += 1
+        # Compact once the dead prefix is half the array, so popping stays O(1) amortized
+        if self.start >= 64 and self.start * 2 >= len(self.ids):
+            del self.ids[:self.start]
+            self.start = 0
+
+    def __contains__(self, message_id):
+        i = bisect.bisect_left(self.ids, message_id, self.start)
+        return i < len(self.ids) and self.ids[i] == message_id
+
+    def bounds(self, first_id, end_id):
+        """Index range of the ids with first_id <= id < end_id."""
+        return (bisect.bisect_left(self.ids, first_id, self.start),
+                bisect.bisect_left(self.ids, end_id, self.start))
+
+class SearchIndex:
+    """Bounded inverted index over recent chat messages.
+
+    Messages get consecutive ids, so every posting list is sorted just by
+    appending, and the oldest message is always at the front of each list
+    it appears in. Evicting a message (once it is older than retention
+    seconds, or when max_messages is reached) pops it from the front of
+    its postings, so the index never holds anything the history doesn't.
+
+    An AND query walks the shortest posting list backwards from the newest
+    match, checking the other terms by binary search, and stops after
+    limit hits. Time filters become an id range by binary search over the
+    message times, which are in order as well.
+    """
+    def __init__(self, retention=3600.0, max_messages=100000, limit=50):
+        self.retention = retention
+        self.max_messages = max_messages
+        self.limit = limit
+        self.lock = threading.Lock()
+
+        # Message id i is at index i - base; the first start entries are evicted
+        self.base = 0
+        self.start = 0
+        self.times = array('d')
+        self.lines = []
+        # Postings each message is in, needed to evict it. Holding the Posting
+        # objects rather than the words avoids a copy of every word per message.
+        self.message_postings = []
+        self.postings = {}  # {term: Posting}
+
+    def __len__(self):
+        return len(self.lines) - self.start
+
+    def add(self, line, text, when=None):
+        """Index text under its words and keep line (the broadcast form) to show in results."""
+        terms = tokenize(text)
+        with self.lock:
+            message_id = self.base + len(self.lines)
+            postings = []
+            for term in terms:
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = Posting(term)
+                posting.ids.append(message_id)
+                postings.append(posting)
+            self.times.append(time.time() if when is None else when)
+            self.lines.append(line)
+            self.message_postings.append(tuple(postings))
+            while len(self) > self.max_messages:
+                self.evict()
+
+    def evict(self):
+        for posting in self.message_postings[self.start]:
+            posting.pop_front()
+            if not posting:
+                del self.postings[posting.term]
+        self.lines[self.start] = self.message_postings[self.start] = None
+        self.start += 1
+        if self.start >= 1024 and self.start * 2 >= len(self.lines):
+            del self.lines[:self.start], self.message_postings[:self.start], self.times[:self.start]
+            self.base += self.start
+            self.start = 0
+
+    def purge(self):
+        """Evict messages older than the retention."""
+        cutoff = time.time() - self.retention
+        with self.lock:
+            while len(self) and self.times[self.start] < cutoff:
+                self.evict()
+
+    def search(self, terms, since=None, until=None, limit=None):
+        """Return (time, line) for the newest messages holding every term, oldest first."""
+        limit = limit or self.limit
+        with self.lock:
+            # Time filters become a range of ids
+            first = self.start
+            end = len(self.lines)
+            if since is not None:
+                first = bisect.bisect_left(self.times, since, first, end)
+            if until is not None:
+                end = bisect.bisect_right(self.times, until, first, end)
+            first_id, end_id = self.base + first, self.base + end
+
+            if not terms:
+                hits = range(end_id - 1, max(first_id, end_id - limit) - 1, -1)
+            else:
+                postings = []
+                for term in terms:
+                    posting = self.postings.get(term)
+                    if posting is None:
+                        return []
+                    postings.append(posting)
+                postings.sort(key=len)
+                shortest, others = postings[0], postings[1:]
+                low, high = shortest.bounds(first_id, end_id)
+                hits = []
+                for i in range(high - 1, low - 1, -1):
+                    message_id = shortest.ids[i]
+                    if all(message_id in other for other in others):
+                        hits.append(message_id)
+                        if len(hits) >= limit:
+                            break
+
+            return [(self.times[i - self.base], self.lines[i - self.base]) for i in reversed(hits)]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'messages': len(self),
+                'terms': len(self.postings),
+                'postings': sum(len(p) for p in self.postings.values()),
+            }
@@ -1,183 +1,212 @@
-import socket
 import threading
-import json
-import pickle
-import time
 import sys
-from rsa import generate_keys, encrypt_text, decrypt_text
+import argparse
+import os
+from rate_limit import RateLimiter, POLICIES
+from listener import SocketOptions, DEFAULT_BACKLOG
+from server_engine import ServerEngine
+from store_forward import StoreAndForward
+from search import SearchIndex
+from tracing import LatencyTracer
 
 class Server:
-    def __init__(self, host='0.0.0.0', port=12345):
-        self.host = host
-        self.port = port
-        self.server_socket = None
-        self.clients = {}  # {client_id: (connection, address, public_key)}
-        self.client_counter = 0
-        self.public_key, self.private_key = generate_keys(bit_length=512)
-        self.running = True
+    """Terminal front-end for ServerEngine.
+    
+    Events from the engine are printed by a single loop reading a bounded
+    subscription, so a slow terminal drops lines rather than slowing down
+    message delivery.
+    """
+    def __init__(self, host='0.0.0.0', port=12345, interactive=True, **engine_options):
+        self.engine = ServerEngine(host, port, **engine_options)
+        self.events = self.engine.subscribe()
         
-    def start(self):
-        """Start the server and listen for incoming connections."""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Read broadcasts and commands from the console
+        self.interactive = interactive
         
+    def start(self):
+        """Start the server and print its events until it stops."""
+        engine = self.engine
         try:
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            print(f"Server started on {self.host}:{self.port}")
-            print(f"Server public key: {self.public_key}")
+            engine.start()
+            print(f"Server started on {engine.host}:{engine.port} (backlog {engine.listener.backlog})")
+            print(f"Server public key: {engine.public_key}")
+            if engine.federation:
+                print(f"Federation node id: {engine.federation.node_id}")
             
             # Start a thread for server input
-            input_thread = threading.Thread(target=self.handle_server_input)
-            input_thread.daemon = True
-            input_thread.start()
+            if self.interactive:
+                input_thread = threading.Thread(target=self.handle_server_input)
+                input_thread.daemon = True
+                input_thread.start()
+            
+            self.print_events()
             
-            # Accept client connections
-            while self.running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
-                    client_id = self.client_counter
-                    self.client_counter += 1
-                    
-                    # Start a thread to handle this client
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address, client_id)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                    
-                except Exception as e:
-                    if self.running:
-                        print(f"Error accepting connection: {e}")
-                        
         except Exception as e:
             print(f"Server error: {e}")
         finally:
             self.shutdown()
     
-    def handle_client(self, client_socket, address, client_id):
-        """Handle communication with a connected client."""
-        print(f"New connection from {address}, assigned ID: {client_id}")
-        
-        try:
-            # Send server's public key to client
-            public_key_data = pickle.dumps(self.public_key)
-            client_socket.send(public_key_data)
-            
-            # Receive client's public key
-            client_public_key_data = client_socket.recv(4096)
-            client_public_key = pickle.loads(client_public_key_data)
-            
-            # Add client to the clients dictionary
-            self.clients[client_id] = (client_socket, address, client_public_key)
-            
-            # Welcome message
-            welcome_msg = f"Welcome! You are connected as client #{client_id}"
-            encrypted_welcome = encrypt_text(welcome_msg, client_public_key)
-            message_data = {
-                'sender': 'server',
-                'encrypted_message': encrypted_welcome
-            }
-            client_socket.send(pickle.dumps(message_data))
-            
-            # Broadcast that a new client has joined
-            self.broadcast(f"Client #{client_id} has joined the server!", exclude_client=None)
-            
-            # Start receiving messages from this client
-            while self.running:
-                try:
-                    # Receive encrypted message
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break
-                    
-                    message_data = pickle.loads(data)
-                    encrypted_message = message_data.get('encrypted_message')
-                    
-                    # Decrypt the message
-                    decrypted_message = decrypt_text(encrypted_message, self.private_key)
-                    print(f"Message from Client #{client_id}: {decrypted_message}")
-                    
-                    # Forward message to all other clients
-                    self.broadcast(decrypted_message, sender_id=client_id)
-                    
-                except ConnectionResetError:
-                    break
-                except Exception as e:
-                    print(f"Error receiving message from client #{client_id}: {e}")
-                    break
-        
-        except Exception as e:
-            print(f"Error handling client #{client_id}: {e}")
-        
-        finally:
-            # Clean up when client disconnects
-            if client_id in self.clients:
-                del self.clients[client_id]
-                print(f"Client #{client_id} disconnected")
-                self.broadcast(f"Client #{client_id} has left the server.", exclude_client=None)
-            
-            client_socket.close()
+    def print_events(self):
+        while self.engine.running:
+            event = self.events.get(timeout=0.5)
+            if event is not None:
+                self.print_event(event)
     
-    def broadcast(self, message, sender_id=None, exclude_client=None):
-        """Send a message to all connected clients except the sender."""
-        sender_name = f"Client #{sender_id}" if sender_id is not None else "Server"
-        formatted_message = f"{sender_name}: {message}"
-        
-        for client_id, (client_socket, _, client_public_key) in self.clients.items():
-            if exclude_client is not None and client_id == exclude_client:
-                continue
-                
-            try:
-                # Encrypt message with client's public key
-                encrypted_message = encrypt_text(formatted_message, client_public_key)
-                message_data = {
-                    'sender': 'server' if sender_id is None else f"client_{sender_id}",
-                    'encrypted_message': encrypted_message
-                }
-                client_socket.send(pickle.dumps(message_data))
-            except Exception as e:
-                print(f"Error broadcasting to client #{client_id}: {e}")
+    def print_event(self, event):
+        event_type = event['type']
+        if event_type == 'message':
+            sender = f"Client #{event['client_id']}"
+            if event['origin'] is not None:
+                sender += f"@{event['origin']}"
+            print(f"Message from {sender}: {event['text']}")
+        elif event_type == 'join':
+            print(f"New connection from {event['address']}, assigned ID: {event['client_id']}")
+        elif event_type == 'leave':
+            reason = f" ({event['reason']})" if event['reason'] else ""
+            print(f"Client #{event['client_id']} disconnected{reason}")
+        elif event_type in ('error', 'info'):
+            print(event['text'])
     
     def handle_server_input(self):
         """Handle input from the server console."""
         print("Server is ready to send messages. Type your message and press Enter.")
         
-        while self.running:
+        while self.engine.running:
             message = input("")
             if message.lower() == '/quit':
                 print("Shutting down server...")
-                self.running = False
-                self.server_socket.close()
+                self.engine.shutdown()
                 break
             elif message.lower() == '/clients':
-                print(f"Connected clients: {list(self.clients.keys())}")
+                print(f"Connected clients: {list(self.engine.clients.keys())}")
+            elif message.lower() == '/stats':
+                counters = self.engine.rate_limiter.snapshot()
+                print("Rate limiting: " + ", ".join(f"{name} {count}" for name, count in counters.items()))
+                if self.engine.store:
+                    held = self.engine.store.snapshot()
+                    print("Held for offline clients: " + ", ".join(f"{name} {count}" for name, count in held.items()))
+                if self.engine.search is not None:
+                    indexed = self.engine.search.snapshot()
+                    print("Search index: " + ", ".join(f"{name} {count}" for name, count in indexed.items()))
+                if self.events.dropped:
+                    print(f"Console lines dropped: {self.events.dropped}")
             elif message:
-                self.broadcast(message)
+                self.engine.broadcast(message)
     
     def shutdown(self):
         """Shutdown the server and close all connections."""
-        self.running = False
-        
-        # Close all client connections
-        for client_id, (client_socket, _, _) in list(self.clients.items()):
-            try:
-                client_socket.close()
-            except:
-                pass
-        
-        # Close server socket
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-        
+        if self.engine.stopped:
+            return
+        self.engine.shutdown()
+        capture = self.engine.capture
+        if capture:
+            print(f"Wrote {capture.count} trace records to {capture.path}")
+        tracer = self.engine.tracer
+        if tracer is not None:
+            print(f"Wrote {tracer.count} latency events to {tracer.path}")
         print("Server has been shut down.")
 
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return (host or 'localhost', int(port))
+
 if __name__ == "__main__":
-    server = Server()
+    parser = argparse.ArgumentParser(description="Run the chat server in the terminal.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--heartbeat-interval', type=float, default=15.0,
+                        help="seconds of silence before a client is pinged (0 disables heartbeats)")
+    parser.add_argument('--heartbeat-timeout', type=float, default=45.0,
+                        help="seconds of silence before a client is disconnected")
+    parser.add_argument('--rate-limit-policy', choices=POLICIES, default='delay',
+                        help="what to do with messages over the limit")
+    parser.add_argument('--max-messages-per-second', type=float, default=5.0,
+                        help="per-client message rate (0 for no limit)")
+    parser.add_argument('--message-burst', type=int, default=20)
+    parser.add_argument('--max-bytes-per-second', type=float, default=64 * 1024,
+                        help="per-client byte rate (0 for no limit)")
+    parser.add_argument('--byte-burst', type=int, default=256 * 1024)
+    parser.add_argument('--relay-max-frames-per-second', type=float, default=200.0,
+                        help="per-client rate of file transfer frames (0 for no limit)")
+    parser.add_argument('--relay-max-bytes-per-second', type=float, default=1024 * 1024,
+                        help="per-client file transfer byte rate (0 for no limit)")
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help="length of the kernel queue of connections waiting to be accepted")
+    parser.add_argument('--no-tcp-nodelay', action='store_true',
+                        help="leave Nagle's algorithm on for client sockets")
+    parser.add_argument('--keepalive', action='store_true', help="enable TCP keepalive on client sockets")
+    parser.add_argument('--send-buffer', type=int, help="SO_SNDBUF for client sockets, in bytes")
+    parser.add_argument('--receive-buffer', type=int, help="SO_RCVBUF for client sockets, in bytes")
+    parser.add_argument('--node-id', help="name of this node, enables linking with other nodes")
+    parser.add_argument('--peer', action='append', type=parse_address, default=[],
+                        help="host:port of another node to link to, may be given more than once")
+    parser.add_argument('--link-secret', default=os.environ.get('CHAT_LINK_SECRET'),
+                        help="secret shared by all linked nodes (default: $CHAT_LINK_SECRET)")
+    parser.add_argument('--link-max-messages-per-second', type=float, default=1000.0,
+                        help="per-link relay rate from another node (0 for no limit)")
+    parser.add_argument('--link-max-bytes-per-second', type=float, default=1024 * 1024,
+                        help="per-link byte rate from another node (0 for no limit)")
+    parser.add_argument('--presence-interval', type=float, default=1.0,
+                        help="seconds over which join/leave notices are coalesced (0 to send each one)")
+    parser.add_argument('--presence-threshold', type=int, default=10,
+                        help="join/leave notices sent individually per interval before switching to a digest")
+    parser.add_argument('--capture', metavar='PATH',
+                        help="record connections and message sizes to a trace file for replay.py")
+    parser.add_argument('--hold-for', type=float, default=0,
+                        help="seconds to keep messages for clients that go offline (0 disables store-and-forward)")
+    parser.add_argument('--hold-in-memory', type=int, default=10000,
+                        help="held messages kept in memory before spilling to disk")
+    parser.add_argument('--hold-max', type=int, default=1000,
+                        help="most held messages delivered to one returning client")
+    parser.add_argument('--spill-dir', default='spill', help="directory for held messages spilled to disk")
+    parser.add_argument('--search-history', type=int, default=0,
+                        help="recent messages kept for /search, e.g. 100000 (0, the default, turns search off)")
+    parser.add_argument('--search-for', type=float,
+                        help="seconds messages stay searchable (default: --hold-for if set, else 3600)")
+    parser.add_argument('--trace-latency', metavar='PATH',
+                        help="log the server hops of traced messages for latency_report.py")
+    parser.add_argument('--no-console', action='store_true',
+                        help="don't read broadcasts and commands from stdin")
+    args = parser.parse_args()
+    if args.node_id and not args.link_secret:
+        parser.error("--node-id needs --link-secret (or $CHAT_LINK_SECRET) so only your nodes can link")
+    
+    rate_limiter = RateLimiter(args.max_messages_per_second, args.message_burst,
+                               args.max_bytes_per_second, args.byte_burst,
+                               policy=args.rate_limit_policy)
+    # File transfers are always slowed down rather than dropped
+    relay_rate_limiter = RateLimiter(args.relay_max_frames_per_second, int(args.relay_max_frames_per_second * 2),
+                                     args.relay_max_bytes_per_second, int(args.relay_max_bytes_per_second * 4))
+    link_rate_limiter = RateLimiter(args.link_max_messages_per_second, int(args.link_max_messages_per_second * 2),
+                                    args.link_max_bytes_per_second, int(args.link_max_bytes_per_second * 4))
+    socket_options = SocketOptions(nodelay=not args.no_tcp_nodelay, keepalive=args.keepalive,
+                                   send_buffer=args.send_buffer, receive_buffer=args.receive_buffer)
+    store = None
+    if args.hold_for:
+        store = StoreAndForward(args.spill_dir, retention=args.hold_for,
+                                memory_limit=args.hold_in_memory, max_pending=args.hold_max)
+    search = None
+    if args.search_history:
+        search = SearchIndex(retention=args.search_for or args.hold_for or 3600.0,
+                             max_messages=args.search_history)
+    server = Server(args.host, args.port,
+                    heartbeat_interval=args.heartbeat_interval,
+                    heartbeat_timeout=args.heartbeat_timeout,
+                    rate_limiter=rate_limiter,
+                    relay_rate_limiter=relay_rate_limiter,
+                    node_id=args.node_id,
+                    peers=args.peer,
+                    link_secret=args.link_secret,
+                    link_rate_limiter=link_rate_limiter,
+                    interactive=not args.no_console,
+                    presence_interval=args.presence_interval,
+                    presence_threshold=args.presence_threshold,
+                    capture_path=args.capture,
+                    backlog=args.backlog,
+                    socket_options=socket_options,
+                    store=store,
+                    search=search,
+                    tracer=LatencyTracer(args.trace_latency, "server") if args.trace_latency else None)
     try:
         server.start()
     except KeyboardInterrupt:
@@ -0,0 +1,644 @@
+import socket
+import threading
+import pickle
+import secrets
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from rsa import generate_keys, encrypt_text, decrypt_text, verify
+from protocol import FrameReader, FrameTemplate, PING_FRAME, RELAY_FRAME_TYPES, login_message
+from timer_wheel import TimerWheel
+from rate_limit import RateLimiter
+from federation import Federation
+from presence import PresenceDigest
+from capture import TraceWriter, CONNECT, MESSAGE, DISCONNECT
+from listener import Listener, DEFAULT_BACKLOG
+from store_forward import fingerprint
+from search import parse_query
+from tracing import parse_trace
+
+# Clients over their rate limit are told at most this often (seconds)
+NOTICE_INTERVAL = 1.0
+
+# Seconds a new client has to answer the identity challenge
+HANDSHAKE_TIMEOUT = 10.0
+
+# How often expired store-and-forward and search history entries are purged
+# (seconds), and how many held messages go in one batch frame
+PURGE_INTERVAL = 10.0
+BATCH_SIZE = 200
+
+SERVER_FRAME = FrameTemplate({'sender': 'server'})
+NOTICE_FRAME = FrameTemplate({'type': 'notice', 'sender': 'server'})
+
+def fit_to_key(text, public_key):
+    """Cut text down to what one RSA block under public_key can carry."""
+    limit = (public_key[1].bit_length() - 1) // 8
+    data = text.encode('utf-8')
+    if len(data) <= limit:
+        return text
+    return data[:limit - 3].decode('utf-8', 'ignore') + "..."
+
+class ClientSession:
+    """Per-connection state kept by the server."""
+    def __init__(self, client_id, client_socket, address, public_key, rate_buckets, relay_buckets):
+        self.client_id = client_id
+        self.socket = client_socket
+        self.address = address
+        self.public_key = public_key
+        self.send_lock = threading.Lock()
+        self.last_seen = time.monotonic()
+        # Wall-clock start of what this client could have received, which
+        # is all /search will show it
+        self.searchable_since = time.time()
+        self.heartbeat = None  # Pending TimerWheel timer
+        self.rate_buckets = rate_buckets
+        self.relay_buckets = relay_buckets  # File transfer frames have their own budget
+        self.last_notice = 0.0
+        self.leave_reason = None  # Why the server dropped the client, if it did
+        self.fingerprint = fingerprint(public_key)  # Identity for store-and-forward
+
+    def send(self, data):
+        """Send a whole frame. Frames from different threads never interleave."""
+        with self.send_lock:
+            self.socket.sendall(data)
+
+    def send_frame(self, template, ciphertext):
+        """Send a chat frame built from a shared FrameTemplate and this client's ciphertext."""
+        self.send(template.frame(ciphertext))
+
+class Subscription:
+    """Bounded queue of engine events for one observer.
+
+    The engine never waits for an observer. When the queue is full, most
+    events are dropped and counted. Join and leave events never are, since
+    front-ends keep client lists from them. They go to an overflow map
+    keyed by client id instead, so a client that joined and left again
+    while nobody was reading cancels out. That map only holds clients
+    whose state changed, so it stays bounded by the clients connected.
+    Queued events are handed out before overflowed ones, which keeps each
+    client's join ahead of its leave.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.events = deque()
+        self.presence = OrderedDict()  # {client_id: join or leave event} that didn't fit
+        self.ready = threading.Condition()
+        self.dropped = 0
+
+    def put(self, event):
+        with self.ready:
+            presence_event = event['type'] in ('join', 'leave')
+            if len(self.events) < self.maxsize and not (presence_event and self.presence):
+                self.events.append(event)
+            elif presence_event:
+                client_id = event['client_id']
+                earlier = self.presence.pop(client_id, None)
+                if not (earlier and earlier['type'] == 'join' and event['type'] == 'leave'):
+                    self.presence[client_id] = event
+            else:
+                self.dropped += 1
+                return
+            self.ready.notify()
+
+    def pop(self):
+        if self.events:
+            return self.events.popleft()
+        return self.presence.popitem(last=False)[1]
+
+    def get(self, timeout=None):
+        """Return the next event, or None if none arrived within timeout."""
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.events or self.presence, timeout):
+                return None
+            return self.pop()
+
+    def drain(self, limit):
+        """Return up to limit events that are already waiting, without blocking."""
+        with self.ready:
+            events = []
+            while len(events) < limit and (self.events or self.presence):
+                events.append(self.pop())
+            return events
+
+class ServerEngine:
+    """Headless chat server shared by server_cli.py and server_gui.py.
+
+    The engine accepts clients, relays their messages and runs heartbeats,
+    rate limiting, presence digests and federation on its own threads. It
+    doesn't print or draw anything. Front-ends call subscribe() and read
+    event dicts from the returned Subscription, each with a 'type' and 'time':
+
+        join     client_id, address
+        leave    client_id, reason (None for a normal disconnect)
+        message  client_id, origin (node id, None for local clients), text
+        error    text
+        info     text (links to other nodes coming and going)
+        stats    clients, messages, rate_limit, dropped
+    """
+    def __init__(self, host='0.0.0.0', port=12345, heartbeat_interval=15.0, heartbeat_timeout=45.0,
+                 rate_limiter=None, relay_rate_limiter=None, node_id=None, peers=(), link_secret=None,
+                 link_rate_limiter=None,
+                 presence_interval=1.0, presence_threshold=10, capture_path=None,
+                 backlog=DEFAULT_BACKLOG, socket_options=None, keys=None, stats_interval=1.0,
+                 store=None, search=None, tracer=None):
+        self.host = host
+        self.port = port
+        self.listener = Listener(host, port, backlog, socket_options, on_error=self.report_error)
+        self.clients = {}  # {client_id: ClientSession}
+        # Broadcasts log for offline clients and pick their recipients under
+        # this lock, and a returning client takes its held lines and joins
+        # self.clients under it, so it gets each broadcast exactly once
+        self.publish_lock = threading.Lock()
+        self.client_counter = 0
+        self.public_key, self.private_key = keys or generate_keys(bit_length=512)
+        self.running = False
+        self.stopped = False
+
+        # Idle clients are pinged every heartbeat_interval seconds and dropped
+        # after heartbeat_timeout seconds of silence. 0 disables heartbeats.
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.timers = TimerWheel(on_error=self.report_error)
+        # Pings and presence digests go out on a small pool so a full socket
+        # can't stall the wheel
+        self.worker_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="server")
+
+        # Join and leave notices are coalesced into digests during storms.
+        # An interval of 0 announces every change on its own.
+        self.presence = PresenceDigest(self.timers, self.worker_pool, self.broadcast_presence,
+                                       presence_interval, presence_threshold, on_error=self.report_error)
+
+        # Optional StoreAndForward holding broadcasts for clients that are offline
+        self.store = store
+
+        # Optional SearchIndex over recent client messages, for /search
+        self.search = search
+
+        # Per-client message and byte limits, checked before any decryption
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # File transfer frames are limited separately so transfers don't eat
+        # into chat. Over the limit they are always delayed, never dropped,
+        # since a dropped chunk or ack stalls the transfer until it times out.
+        self.relay_rate_limiter = relay_rate_limiter or RateLimiter(200.0, 400, 1024 * 1024, 4 * 1024 * 1024)
+        if self.relay_rate_limiter.policy != 'delay':
+            raise ValueError("relay_rate_limiter must use the 'delay' policy")
+
+        # Linking nodes into one chat needs a node id and a secret shared by
+        # all nodes; peers are (host, port) pairs
+        self.federation = None
+        if node_id:
+            self.federation = Federation(self, node_id, peers, link_secret, link_rate_limiter)
+
+        # Optional trace of connections and message sizes for replay.py
+        self.capture = TraceWriter(capture_path) if capture_path else None
+
+        # Optional LatencyTracer logging the server hops of traced messages
+        self.tracer = tracer
+
+        # Observers and the counters reported in 'stats' events
+        self.subscribers = []
+        self.stats_interval = stats_interval
+        self.stats_lock = threading.Lock()
+        self.message_count = 0
+
+    def subscribe(self, maxsize=10000):
+        """Return a Subscription that receives every event from now on."""
+        subscription = Subscription(maxsize)
+        # Replace rather than append so emit() can iterate without a lock
+        self.subscribers = self.subscribers + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers = [s for s in self.subscribers if s is not subscription]
+
+    def emit(self, event_type, **fields):
+        subscribers = self.subscribers
+        if not subscribers:
+            return
+        fields['type'] = event_type
+        fields['time'] = time.time()
+        for subscription in subscribers:
+            subscription.put(fields)
+
+    def report_error(self, text):
+        self.emit('error', text=text)
+
+    def start(self):
+        """Open the listening socket and serve clients in the background.
+
+        Raises OSError if the address can't be bound.
+        """
+        self.listener.open()
+        self.port = self.listener.port
+        self.running = True
+        self.timers.start()
+        if self.stats_interval:
+            self.timers.schedule(self.stats_interval, self.emit_stats)
+        if self.store or self.search is not None:
+            self.timers.schedule(PURGE_INTERVAL, self.schedule_purge)
+        if self.federation:
+            self.federation.start()
+
+        accept_thread = threading.Thread(target=self.serve)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+    def serve(self):
+        try:
+            self.listener.serve(self.accept_client)
+        except Exception as e:
+            if self.running:
+                self.emit('error', text=f"Server error: {e}")
+        finally:
+            self.shutdown()
+
+    def accept_client(self, client_socket, client_address):
+        """Hand a new connection to its own handler thread, so the accept loop never waits on a handshake."""
+        client_id = self.client_counter
+        self.client_counter += 1
+
+        client_thread = threading.Thread(
+            target=self.handle_client,
+            args=(client_socket, client_address, client_id)
+        )
+        client_thread.daemon = True
+        client_thread.start()
+
+    def handle_client(self, client_socket, address, client_id):
+        """Handle communication with a connected client."""
+        session = None
+        try:
+            # A connection that never finishes the handshake mustn't hold
+            # this thread; heartbeats only start once it has
+            client_socket.settimeout(HANDSHAKE_TIMEOUT)
+
+            # Send server's public key to client
+            public_key_data = pickle.dumps(self.public_key)
+            client_socket.sendall(public_key_data)
+
+            # Receive client's public key. The reader keeps any messages that
+            # arrive in the same segment as the key.
+            reader = FrameReader(client_socket)
+            handshake = reader.read()
+            if handshake is None:
+                return
+            client_public_key, _ = handshake
+
+            # Another server node linking up rather than a client
+            if isinstance(client_public_key, dict) and client_public_key.get('type') == 'peer_hello':
+                if self.federation is None:
+                    self.emit('error', text=f"Rejected link from node {client_public_key.get('node_id')}: no node id set")
+                    return
+                self.federation.accept(client_socket, reader, client_public_key)
+                return
+
+            # Held messages and peer keys go by public key, so the client has
+            # to show it holds the matching private key
+            if not self.check_identity(client_socket, reader, client_public_key):
+                self.emit('error', text=f"Client at {address} could not prove it holds its key")
+                return
+            client_socket.settimeout(None)
+
+            # Add client to the clients dictionary, along with taking what
+            # was held for its key
+            session = ClientSession(client_id, client_socket, address, client_public_key,
+                                    self.rate_limiter.new_buckets(), self.relay_rate_limiter.new_buckets())
+            with self.publish_lock:
+                held = self.store.connected(session.fingerprint) if self.store else None
+                self.clients[client_id] = session
+            if self.capture:
+                self.capture.record(CONNECT, client_id)
+            if self.heartbeat_interval:
+                session.heartbeat = self.timers.schedule(self.heartbeat_interval, self.check_heartbeat, session)
+            self.emit('join', client_id=client_id, address=address)
+
+            # Welcome message
+            welcome_msg = f"Welcome! You are connected as client #{client_id}"
+            encrypted_welcome = encrypt_text(welcome_msg, client_public_key)
+            session.send_frame(SERVER_FRAME, encrypted_welcome)
+
+            # Catch up on what was broadcast while this key was offline
+            if held is not None:
+                self.send_held_messages(session, *held)
+
+            # Tell everyone a new client has joined
+            self.presence.joined(client_id)
+
+            # Start receiving messages from this client
+            while self.running:
+                try:
+                    # Receive encrypted message
+                    frame = reader.read()
+                    if frame is None:
+                        break
+
+                    message_data, size = frame
+                    session.last_seen = time.monotonic()
+                    frame_type = message_data.get('type')
+                    if frame_type == 'pong':
+                        continue
+
+                    # File transfer frames are passed on without being read
+                    if frame_type in RELAY_FRAME_TYPES:
+                        self.relay_rate_limiter.admit(session.relay_buckets, size)
+                        self.relay(session, message_data)
+                        continue
+
+                    # Throttle before paying for decryption and broadcast
+                    action = self.rate_limiter.admit(session.rate_buckets, size)
+                    if action == 'drop':
+                        self.send_rate_limit_notice(session)
+                        continue
+                    if action == 'disconnect':
+                        session.leave_reason = "exceeded the rate limit"
+                        break
+                    admitted_at = time.monotonic()
+                    if frame_type == 'key_request':
+                        self.send_peer_key(session, message_data.get('client_id'))
+                        continue
+
+                    encrypted_message = message_data.get('encrypted_message')
+                    trace = None
+                    if self.tracer is not None and 'trace' in message_data:
+                        trace = parse_trace(message_data['trace'])
+
+                    # Decrypt the message
+                    decrypted_message = decrypt_text(encrypted_message, self.private_key)
+                    trace_id = None
+                    if trace is not None:
+                        trace_id, composed_at = trace
+                        self.tracer.record(trace_id, 'client_compose', when=composed_at)
+                        self.tracer.record(trace_id, 'server_receive', when=session.last_seen)
+                        self.tracer.record(trace_id, 'server_admit', when=admitted_at)
+                        self.tracer.record(trace_id, 'server_decrypt')
+                    if decrypted_message.split(' ', 1)[0] == '/search':
+                        self.send_search_results(session, decrypted_message[len('/search'):])
+                        continue
+                    with self.stats_lock:
+                        self.message_count += 1
+                    self.emit('message', client_id=client_id, origin=None, text=decrypted_message)
+                    if self.capture:
+                        self.capture.record(MESSAGE, client_id, size, len(decrypted_message.encode('utf-8')))
+
+                    # Forward message to all other clients, and to the other nodes
+                    self.broadcast(decrypted_message, sender_id=client_id, trace_id=trace_id)
+                    if self.federation:
+                        self.federation.publish(decrypted_message, client_id)
+
+                except ConnectionResetError:
+                    break
+                except Exception as e:
+                    self.emit('error', text=f"Error receiving message from client #{client_id}: {e}")
+                    break
+
+        except Exception as e:
+            self.emit('error', text=f"Error handling client #{client_id}: {e}")
+
+        finally:
+            # Clean up when client disconnects
+            if session is not None and self.clients.pop(client_id, None) is session:
+                if session.heartbeat:
+                    session.heartbeat.cancel()
+                if self.capture:
+                    self.capture.record(DISCONNECT, client_id)
+                self.emit('leave', client_id=client_id, reason=session.leave_reason)
+                if self.store:
+                    self.store.disconnected(session.fingerprint)
+                self.presence.left(client_id)
+
+            client_socket.close()
+
+    def check_identity(self, client_socket, reader, public_key):
+        """Have a new client sign a fresh nonce with its private key."""
+        nonce = secrets.token_bytes(16)
+        client_socket.sendall(pickle.dumps({'type': 'challenge', 'nonce': nonce}))
+        frame = reader.read()
+        if frame is None or not isinstance(frame[0], dict):
+            return False
+        try:
+            return verify(login_message(nonce, self.public_key, public_key), frame[0].get('signature'), public_key)
+        except (TypeError, ValueError):
+            return False  # Not a usable key
+
+    def broadcast(self, message, sender_id=None, exclude_client=None, origin=None, hold=True,
+                  trace_id=None):
+        """Send a message to all connected clients except the sender.
+
+        origin is the id of the node the sender is connected to, for
+        messages relayed from another node. Unless hold is False the message
+        is also kept for offline clients. A trace_id is passed on to the
+        recipients, and each send is logged against it.
+        """
+        if trace_id is not None:
+            self.tracer.record(trace_id, 'server_fanout')
+        if sender_id is None:
+            sender_name, sender_tag = "Server", "server"
+        elif origin is None:
+            sender_name, sender_tag = f"Client #{sender_id}", f"client_{sender_id}"
+        else:
+            sender_name, sender_tag = f"Client #{sender_id}@{origin}", f"client_{sender_id}@{origin}"
+        formatted_message = f"{sender_name}: {message}"
+        with self.publish_lock:
+            if hold and self.store:
+                self.store.append(formatted_message)
+            recipients = list(self.clients.items())
+        if self.search is not None and sender_id is not None:
+            self.search.add(formatted_message, message)
+
+        # Everything but the ciphertext is serialized once for all recipients
+        if sender_id is None:
+            template = SERVER_FRAME
+        elif trace_id is None:
+            template = FrameTemplate({'sender': sender_tag})
+        else:
+            template = FrameTemplate({'sender': sender_tag, 'trace': trace_id})
+
+        for client_id, session in recipients:
+            if exclude_client is not None and client_id == exclude_client:
+                continue
+
+            try:
+                # Encrypt message with client's public key
+                encrypted_message = encrypt_text(formatted_message, session.public_key)
+                if trace_id is not None:
+                    self.tracer.record(trace_id, 'server_send', session.fingerprint)
+                session.send_frame(template, encrypted_message)
+            except Exception as e:
+                self.emit('error', text=f"Error broadcasting to client #{client_id}: {e}")
+
+    def relay(self, session, frame):
+        """Pass a frame addressed to one client on to it, marked with who sent it."""
+        recipient_id = frame.pop('to', None)
+        frame['from'] = session.client_id
+        try:
+            recipient = self.clients.get(recipient_id)
+            if recipient is None:
+                raise ConnectionError(f"No client #{recipient_id} is connected")
+            recipient.send(pickle.dumps(frame))
+        except Exception as e:
+            if frame.get('type') != 'file_error':
+                # Sent as if from the recipient, since it is about that transfer
+                error = {'type': 'file_error', 'from': recipient_id,
+                         'transfer_id': frame.get('transfer_id'), 'error': str(e)}
+                session.send(pickle.dumps(error))
+
+    def send_peer_key(self, session, client_id):
+        """Tell a client another client's public key, or None if it isn't connected."""
+        peer = self.clients.get(client_id)
+        session.send(pickle.dumps({
+            'type': 'key_response',
+            'client_id': client_id,
+            'public_key': peer.public_key if peer else None,
+        }))
+
+    def broadcast_presence(self, notice):
+        # Joins and leaves are stale by the time anyone reconnects
+        self.broadcast(notice, hold=False)
+
+    def send_held_messages(self, session, lines, skipped):
+        """Send the messages a returning client missed, in as few frames as possible."""
+        left_at = self.store.left_at(session.fingerprint)
+        if lines:
+            # Messages held for the client count as received
+            session.searchable_since = left_at
+            summary = f"Server: {len(lines)} messages while you were away"
+            if skipped:
+                summary += f" ({skipped} older dropped)"
+            lines.insert(0, summary)
+
+            for start in range(0, len(lines), BATCH_SIZE):
+                session.send(pickle.dumps({
+                    'type': 'batch',
+                    'sender': 'server',
+                    'encrypted_messages': [encrypt_text(fit_to_key(line, session.public_key), session.public_key)
+                                           for line in lines[start:start + BATCH_SIZE]],
+                }))
+        # Only forgotten once sent: if the connection fails first they are
+        # kept for the next one
+        self.store.delivered(session.fingerprint)
+
+    def send_search_results(self, session, query):
+        """Answer a /search with every matching line in one batch frame.
+
+        Only messages sent while the client was connected, or held for it
+        while it was offline, are searched.
+        """
+        if self.search is None:
+            lines = ["Server: Search is not enabled on this server"]
+        else:
+            try:
+                terms, since, until = parse_query(query)
+            except ValueError as e:
+                lines = [f"Server: {e}"]
+            else:
+                since = max(since or 0.0, session.searchable_since)
+                results = self.search.search(terms, since, until)
+                plural = "" if len(results) == 1 else "s"
+                lines = [f"Server: {len(results)} result{plural} for '{query.strip()}'"]
+                lines += [f"[{time.strftime('%H:%M', time.localtime(when))}] {line}" for when, line in results]
+
+        session.send(pickle.dumps({
+            'type': 'batch',
+            'sender': 'server',
+            'encrypted_messages': [encrypt_text(fit_to_key(line, session.public_key), session.public_key)
+                                   for line in lines],
+        }))
+
+    def schedule_purge(self):
+        """Runs on the timer wheel; the purge itself may touch the disk, so it goes to the pool."""
+        if not self.running:
+            return
+        self.worker_pool.submit(self.purge_history)
+        self.timers.schedule(PURGE_INTERVAL, self.schedule_purge)
+
+    def purge_history(self):
+        # Held messages and the search index expire on the same schedule
+        if self.store:
+            self.store.purge()
+        if self.search is not None:
+            self.search.purge()
+
+    def announce(self, message):
+        """Broadcast a server message from a worker thread, so the caller never blocks."""
+        return self.worker_pool.submit(self.broadcast, message)
+
+    def send_rate_limit_notice(self, session):
+        """Tell a client its messages are being dropped, at most once per NOTICE_INTERVAL."""
+        now = time.monotonic()
+        if now - session.last_notice < NOTICE_INTERVAL:
+            return
+        session.last_notice = now
+
+        notice = encrypt_text("Server: Rate limit exceeded, message dropped", session.public_key)
+        session.send_frame(NOTICE_FRAME, notice)
+
+    def check_heartbeat(self, session):
+        """Ping an idle client, or evict it once it has been silent too long.
+
+        Runs on the timer wheel thread, so it only schedules work.
+        """
+        if self.clients.get(session.client_id) is not session:
+            return
+
+        idle = time.monotonic() - session.last_seen
+        if idle >= self.heartbeat_timeout:
+            session.leave_reason = f"timed out after {idle:.0f}s of silence"
+            try:
+                # Wakes the handler thread blocked in recv so it cleans up
+                session.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
+
+        if idle >= self.heartbeat_interval:
+            self.worker_pool.submit(self.send_ping, session)
+            delay = min(self.heartbeat_interval, self.heartbeat_timeout - idle)
+        else:
+            delay = self.heartbeat_interval - idle
+        session.heartbeat = self.timers.schedule(delay, self.check_heartbeat, session)
+
+    def send_ping(self, session):
+        try:
+            session.send(PING_FRAME)
+        except OSError:
+            pass  # The handler thread notices the broken connection
+
+    def emit_stats(self):
+        """Publish a 'stats' event and schedule the next one. Runs on the timer wheel thread."""
+        if not self.running:
+            return
+        with self.stats_lock:
+            messages = self.message_count
+        self.emit('stats', clients=len(self.clients), messages=messages,
+                  rate_limit=self.rate_limiter.snapshot(),
+                  dropped=sum(s.dropped for s in self.subscribers))
+        self.timers.schedule(self.stats_interval, self.emit_stats)
+
+    def shutdown(self):
+        """Stop serving and close all connections. Safe to call more than once."""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.running = False
+        self.timers.stop()
+        self.presence.close()
+        self.worker_pool.shutdown(wait=False)
+        if self.federation:
+            self.federation.close()
+        if self.capture:
+            self.capture.close()
+        if self.store:
+            self.store.close()
+        if self.tracer is not None:
+            self.tracer.close()
+
+        # Close all client connections
+        for client_id, session in list(self.clients.items()):
+            try:
+                session.socket.close()
+            except OSError:
+                pass
+
+        # Stop accepting connections
+        self.listener.close()
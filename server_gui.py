@@ -1,17 +1,23 @@
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, ttk
 import threading
-import socket
-import pickle
+import time
 import sys
 import os
-from datetime import datetime
 
 # Import from the local rsa.py module
-from rsa import generate_keys, encrypt_text, decrypt_text
+from rsa import generate_keys
+from chat_view import ChatRenderQueue, ClientListView, DEFAULT_SCROLLBACK
+from server_engine import ServerEngine
+
+# The window reads engine events at most this often, and at most this many at a time
+EVENT_INTERVAL_MS = 100
+MAX_EVENTS_PER_POLL = 1000
+EVENT_QUEUE_SIZE = 20000
 
 class ChatServerGUI:
-    def __init__(self, root):
+    def __init__(self, root, scrollback=DEFAULT_SCROLLBACK):
+        self.started = time.perf_counter()
         self.root = root
         self.root.title("Secure Chat Server")
         self.root.geometry("800x600")
@@ -20,19 +26,30 @@ class ChatServerGUI:
         # Server variables
         self.host = tk.StringVar(value="0.0.0.0")
         self.port = tk.IntVar(value=12345)
-        self.server_socket = None
-        self.clients = {}  # {client_id: (connection, address, public_key)}
-        self.client_counter = 0
+        self.engine = None
+        self.events = None     # Subscription to the engine's events
+        self.poll_id = None
+        self.last_stats = None  # (time, message count) from the previous stats event
         self.running = False
         
-        # Generate RSA keys
-        self.public_key, self.private_key = generate_keys(bit_length=512)
-        
         # Create GUI components
         self.create_widgets()
+        self.renderer = ChatRenderQueue(self.root, self.chat_display, max_lines=scrollback)
+        self.root.after_idle(self.on_first_paint)
+        
+        # Generate RSA keys in the background so the window appears straight away.
+        # The server can't be started until they are ready.
+        self.public_key, self.private_key = None, None
+        self.keygen_ms = None
+        self.keys_ready = threading.Event()
+        key_thread = threading.Thread(target=self.generate_keys_in_background)
+        key_thread.daemon = True
+        key_thread.start()
         
         # Initial status update
-        self.update_status("Stopped", "red")
+        self.update_status("Generating keys...", "orange")
+        self.server_btn.config(state=tk.DISABLED)
+        self.root.after(50, self.check_keys)
         
     def create_widgets(self):
         # Main frame
@@ -59,14 +76,15 @@ class ChatServerGUI:
         ttk.Label(server_frame, text="Status:").grid(row=0, column=5, sticky=tk.W, padx=5)
         self.status_label = ttk.Label(server_frame, text="Stopped", foreground="red")
         self.status_label.grid(row=0, column=6, sticky=tk.W, padx=5)
+        self.stats_label = ttk.Label(server_frame, text="")
+        self.stats_label.grid(row=0, column=7, sticky=tk.W, padx=5)
         
         # Client list frame (left side)
         client_frame = ttk.LabelFrame(main_frame, text="Connected Clients", padding=10)
         client_frame.pack(side=tk.LEFT, fill=tk.Y, padx=(0, 5), pady=5)
         
         # Create client list
-        self.client_listbox = tk.Listbox(client_frame, width=20, height=15)
-        self.client_listbox.pack(fill=tk.BOTH, expand=True)
+        self.client_list = ClientListView(self.root, client_frame)
         
         # Chat display and message area (right side)
         chat_frame = ttk.Frame(main_frame)
@@ -92,25 +110,29 @@ class ChatServerGUI:
     def update_status(self, status, color):
         self.status_label.config(text=status, foreground=color)
     
-    def append_message(self, message, tag=None):
-        self.chat_display.config(state=tk.NORMAL)
-        timestamp = datetime.now().strftime("[%H:%M:%S] ")
-        
-        # Insert timestamp
-        self.chat_display.insert(tk.END, timestamp, "timestamp")
-        
-        # Insert message with appropriate tag
-        self.chat_display.insert(tk.END, message + "\n", tag)
+    def on_first_paint(self):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        self.append_message(f"Window ready in {elapsed:.0f} ms", "system")
+    
+    def generate_keys_in_background(self):
+        started = time.perf_counter()
+        self.public_key, self.private_key = generate_keys(bit_length=512)
+        self.keygen_ms = (time.perf_counter() - started) * 1000
+        self.keys_ready.set()
+    
+    def check_keys(self):
+        """Poll for the background key generation and enable Start once done."""
+        if not self.keys_ready.is_set():
+            self.root.after(50, self.check_keys)
+            return
         
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
+        self.append_message(f"Keys generated in {self.keygen_ms:.0f} ms", "system")
+        self.update_status("Stopped", "red")
+        self.server_btn.config(state=tk.NORMAL)
     
-    def update_client_list(self):
-        """Update the client list display"""
-        self.client_listbox.delete(0, tk.END)
-        for client_id in sorted(self.clients.keys()):
-            _, address, _ = self.clients[client_id]
-            self.client_listbox.insert(tk.END, f"Client #{client_id} ({address[0]})")
+    def append_message(self, message, tag=None):
+        """Queue a line for the chat display. Safe to call from any thread."""
+        self.renderer.put(message, tag)
     
     def toggle_server(self):
         """Start or stop the server"""
@@ -120,7 +142,7 @@ class ChatServerGUI:
             self.start_server()
     
     def start_server(self):
-        """Start the server and listen for connections"""
+        """Start the server engine and begin observing its events"""
         if self.running:
             return
         
@@ -128,12 +150,11 @@ class ChatServerGUI:
             host = self.host.get()
             port = self.port.get()
             
-            # Create and configure server socket
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((host, port))
-            self.server_socket.settimeout(0.5)  # Add timeout for clean shutdown
-            self.server_socket.listen(5)
+            # The engine reuses the keys generated at startup
+            self.engine = ServerEngine(host, port, keys=(self.public_key, self.private_key))
+            self.events = self.engine.subscribe(maxsize=EVENT_QUEUE_SIZE)
+            self.last_stats = None
+            self.engine.start()
             
             # Update UI
             self.running = True
@@ -143,13 +164,10 @@ class ChatServerGUI:
             self.send_btn.config(state=tk.NORMAL)
             
             # Log server start
-            self.append_message(f"Server started on {host}:{port}", "system")
+            self.append_message(f"Server started on {host}:{self.engine.port}", "system")
             self.append_message(f"Server public key: {self.public_key}", "system")
             
-            # Start accepting clients in a separate thread
-            accept_thread = threading.Thread(target=self.accept_clients)
-            accept_thread.daemon = True
-            accept_thread.start()
+            self.poll_id = self.root.after(EVENT_INTERVAL_MS, self.poll_events)
             
         except Exception as e:
             messagebox.showerror("Server Error", f"Failed to start server: {str(e)}")
@@ -159,151 +177,81 @@ class ChatServerGUI:
         """Stop the server and disconnect all clients"""
         self.running = False
         
-        # Close all client connections
-        for client_id, (client_socket, _, _) in list(self.clients.items()):
-            try:
-                client_socket.close()
-            except:
-                pass
-        
-        self.clients.clear()
+        if self.poll_id is not None:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
         
-        # Close server socket
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-            self.server_socket = None
+        # Close all connections and the listening socket
+        if self.engine:
+            self.engine.shutdown()
+            self.engine = None
+            self.events = None
         
         # Update UI
         self.update_status("Stopped", "red")
+        self.stats_label.config(text="")
         self.server_btn.config(text="Start Server")
         self.message_input.config(state=tk.DISABLED)
         self.send_btn.config(state=tk.DISABLED)
-        self.update_client_list()
+        self.client_list.clear()
         
         # Log server stop
         self.append_message("Server stopped", "system")
     
-    def accept_clients(self):
-        """Accept incoming client connections"""
-        while self.running:
-            try:
-                client_socket, client_address = self.server_socket.accept()
-                client_id = self.client_counter
-                self.client_counter += 1
-                
-                # Start a thread to handle this client
-                client_thread = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket, client_address, client_id)
-                )
-                client_thread.daemon = True
-                client_thread.start()
-                
-            except socket.timeout:
-                continue  # Just a timeout for clean shutdown checking
-            except Exception as e:
-                if self.running:
-                    self.root.after(0, self.append_message, f"Error accepting connection: {str(e)}", "error")
-    
-    def handle_client(self, client_socket, address, client_id):
-        """Handle communication with a connected client"""
-        try:
-            # Send server's public key to client
-            public_key_data = pickle.dumps(self.public_key)
-            client_socket.send(public_key_data)
-            
-            # Receive client's public key
-            client_public_key_data = client_socket.recv(4096)
-            client_public_key = pickle.loads(client_public_key_data)
-            
-            # Add client to the clients dictionary
-            self.clients[client_id] = (client_socket, address, client_public_key)
-            
-            # Update UI in main thread
-            self.root.after(0, self.append_message, f"New connection from {address}, assigned ID: {client_id}", "system")
-            self.root.after(0, self.update_client_list)
-            
-            # Welcome message
-            welcome_msg = f"Welcome! You are connected as client #{client_id}"
-            encrypted_welcome = encrypt_text(welcome_msg, client_public_key)
-            message_data = {
-                'sender': 'server',
-                'encrypted_message': encrypted_welcome
-            }
-            client_socket.send(pickle.dumps(message_data))
-            
-            # Broadcast that a new client has joined
-            self.broadcast(f"Client #{client_id} has joined the server!", exclude_client=None)
-            
-            # Start receiving messages from this client
-            while self.running:
-                try:
-                    # Receive encrypted message
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break
-                    
-                    message_data = pickle.loads(data)
-                    encrypted_message = message_data.get('encrypted_message')
-                    
-                    # Decrypt the message
-                    decrypted_message = decrypt_text(encrypted_message, self.private_key)
-                    
-                    # Display message in UI
-                    display_msg = f"Client #{client_id}: {decrypted_message}"
-                    self.root.after(0, self.append_message, display_msg, "client")
-                    
-                    # Forward message to all other clients
-                    self.broadcast(decrypted_message, sender_id=client_id)
-                    
-                except ConnectionResetError:
-                    break
-                except Exception as e:
-                    self.root.after(0, self.append_message, f"Error receiving from client #{client_id}: {str(e)}", "error")
-                    break
-                
-        except Exception as e:
-            self.root.after(0, self.append_message, f"Error handling client #{client_id}: {str(e)}", "error")
+    def poll_events(self):
+        """Apply a bounded batch of engine events to the display.
         
-        finally:
-            # Clean up when client disconnects
-            if client_id in self.clients:
-                del self.clients[client_id]
-                self.root.after(0, self.append_message, f"Client #{client_id} disconnected", "system")
-                self.root.after(0, self.update_client_list)
-                self.broadcast(f"Client #{client_id} has left the server.", exclude_client=None)
-            
-            client_socket.close()
-    
-    def broadcast(self, message, sender_id=None, exclude_client=None):
-        """Send a message to all connected clients except the sender."""
-        if not self.clients:
+        The engine only ever appends to the subscription queue, so however
+        far behind the window falls, message delivery isn't slowed down.
+        """
+        self.poll_id = None
+        if not self.running:
             return
-            
-        sender_name = f"Client #{sender_id}" if sender_id is not None else "Server"
-        formatted_message = f"{sender_name}: {message}"
         
-        for client_id, (client_socket, _, client_public_key) in self.clients.items():
-            if exclude_client is not None and client_id == exclude_client:
-                continue
-                
-            try:
-                # Encrypt message with client's public key
-                encrypted_message = encrypt_text(formatted_message, client_public_key)
-                message_data = {
-                    'sender': 'server' if sender_id is None else f"client_{sender_id}",
-                    'encrypted_message': encrypted_message
-                }
-                client_socket.send(pickle.dumps(message_data))
-            except Exception as e:
-                self.root.after(0, self.append_message, f"Error broadcasting to client #{client_id}: {str(e)}", "error")
+        for event in self.events.drain(MAX_EVENTS_PER_POLL):
+            self.show_event(event)
+        
+        if not self.engine.running:
+            # The accept loop died, e.g. the socket was closed under us
+            self.stop_server()
+            return
+        self.poll_id = self.root.after(EVENT_INTERVAL_MS, self.poll_events)
+    
+    def show_event(self, event):
+        event_type = event['type']
+        if event_type == 'message':
+            sender = f"Client #{event['client_id']}"
+            if event['origin'] is not None:
+                sender += f"@{event['origin']}"
+            self.append_message(f"{sender}: {event['text']}", "client")
+        elif event_type == 'join':
+            client_id, address = event['client_id'], event['address']
+            self.append_message(f"New connection from {address}, assigned ID: {client_id}", "system")
+            self.client_list.join(client_id, f"Client #{client_id} ({address[0]})")
+        elif event_type == 'leave':
+            reason = f" ({event['reason']})" if event['reason'] else ""
+            self.append_message(f"Client #{event['client_id']} disconnected{reason}", "system")
+            self.client_list.leave(event['client_id'])
+        elif event_type == 'error':
+            self.append_message(event['text'], "error")
+        elif event_type == 'info':
+            self.append_message(event['text'], "system")
+        elif event_type == 'stats':
+            self.show_stats(event)
+    
+    def show_stats(self, event):
+        elapsed = event['time'] - self.last_stats[0] if self.last_stats else 0
+        rate = (event['messages'] - self.last_stats[1]) / elapsed if elapsed > 0 else 0.0
+        self.last_stats = (event['time'], event['messages'])
+        
+        text = f"{event['clients']} clients, {rate:.0f} msg/s"
+        if event['dropped']:
+            text += f", {event['dropped']} events not shown"
+        self.stats_label.config(text=text)
     
     def send_broadcast(self, event=None):
         """Send a broadcast message from the server to all clients"""
-        if not self.running or not self.clients:
+        if not self.running or not self.engine.clients:
             return
             
         message = self.message_input.get().strip()
@@ -317,8 +265,8 @@ class ChatServerGUI:
             # Display in server log
             self.append_message(f"Server: {message}", "server")
             
-            # Broadcast to all clients
-            self.broadcast(message)
+            # Encrypting for every client happens off the Tk thread
+            self.engine.announce(message)
             
         except Exception as e:
             messagebox.showerror("Broadcast Error", f"Failed to broadcast message: {str(e)}")
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+
+def fingerprint(public_key):
+    """Short stable id for a client's public key."""
+    e, n = public_key
+    return hashlib.sha256(f"{e}:{n}".encode()).hexdigest()[:16]
+
+class Segment:
+    """One append-only spill file holding consecutive log entries."""
+    def __init__(self, path, first_seq):
+        self.path = path
+        self.first_seq = first_seq
+        self.last_seq = first_seq - 1
+        self.last_time = 0.0
+        self.offsets = []  # Byte offset of every 64th entry, for seeking
+
+    @property
+    def count(self):
+        return self.last_seq - self.first_seq + 1
+
+class StoreAndForward:
+    """Hold broadcasts for clients that are offline and replay them on reconnect.
+
+    Clients are known by the fingerprint of their public key, so a client
+    that reconnects with the same key pair (see client_cli.py --key-file)
+    gets what it missed. Every queued line is a broadcast that all offline
+    members would get, so rather than a copy per member there is one
+    sequence-numbered log, and each offline member only keeps the sequence
+    number it left at. Memory per member is constant, however many there are.
+
+    The newest memory_limit log entries are kept in memory; older ones are
+    spilled to append-only segment files in spill_dir. Entries older than
+    retention seconds, spill files that only hold such entries, and members
+    offline for longer than that are purged from the front, since all three
+    are kept in time order. Nothing is stored while nobody is offline.
+    """
+    def __init__(self, spill_dir, retention=3600.0, memory_limit=10000,
+                 max_pending=1000, segment_entries=50000):
+        self.spill_dir = spill_dir
+        self.retention = retention
+        self.memory_limit = memory_limit
+        self.max_pending = max_pending
+        self.segment_entries = segment_entries
+        self.lock = threading.Lock()
+
+        self.next_seq = 0
+        self.memory = deque()   # (seq, time, text), oldest first
+        self.segments = deque() # Spilled Segments, oldest first
+        self.spill_file = None  # Open file of the newest segment
+
+        self.online = {}               # {fingerprint: open connections}
+        self.offline = OrderedDict()   # {fingerprint: (seq they left at, time)}, oldest first
+
+        os.makedirs(spill_dir, exist_ok=True)
+        # Spill files from an earlier run can't be matched to anyone any more
+        for name in os.listdir(spill_dir):
+            if name.startswith("spill-") and name.endswith(".log"):
+                os.remove(os.path.join(spill_dir, name))
+
+    def connected(self, key):
+        """Register a connection and return the lines it missed while offline.
+
+        The lines stay held until delivered() is called for the key.
+        """
+        with self.lock:
+            self.online[key] = self.online.get(key, 0) + 1
+            left = self.offline.get(key)
+            if left is None:
+                return [], 0
+            first_seq = left[0]
+            end_seq = self.next_seq
+        # Reading a spill file happens outside the lock
+        skipped = max(end_seq - first_seq - self.max_pending, 0)
+        return self.read(first_seq + skipped, end_seq), skipped
+
+    def left_at(self, key):
+        """Wall-clock time an offline member left, or None."""
+        with self.lock:
+            left = self.offline.get(key)
+            return left[1] if left else None
+
+    def delivered(self, key):
+        """Forget what a connected member missed, now that it has been sent."""
+        with self.lock:
+            self.offline.pop(key, None)
+
+    def disconnected(self, key):
+        with self.lock:
+            remaining = self.online.get(key, 1) - 1
+            if remaining > 0:
+                self.online[key] = remaining
+                return
+            self.online.pop(key, None)
+            # A member that left before its held lines were sent keeps its place
+            if key not in self.offline:
+                self.offline[key] = (self.next_seq, time.time())
+
+    def append(self, text):
+        """Log a broadcast line if any member is offline to need it."""
+        with self.lock:
+            if not self.offline:
+                return
+            self.memory.append((self.next_seq, time.time(), text))
+            self.next_seq += 1
+            while len(self.memory) > self.memory_limit:
+                self.spill(*self.memory.popleft())
+
+    def spill(self, seq, when, text):
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or segment.count >= self.segment_entries or segment.last_seq != seq - 1:
+            if self.spill_file:
+                self.spill_file.close()
+            segment = Segment(os.path.join(self.spill_dir, f"spill-{seq}.log"), seq)
+            self.segments.append(segment)
+            self.spill_file = open(segment.path, 'a', encoding='utf-8')
+
+        if (seq - segment.first_seq) % 64 == 0:
+            segment.offsets.append(self.spill_file.tell())
+        self.spill_file.write(json.dumps([seq, when, text]) + "\n")
+        segment.last_seq = seq
+        segment.last_time = when
+
+    def read(self, first_seq, end_seq):
+        """Return the logged lines with first_seq <= seq < end_seq still retained."""
+        with self.lock:
+            if self.spill_file:
+                self.spill_file.flush()
+            segments = [s for s in self.segments if s.last_seq >= first_seq and s.first_seq < end_seq]
+            in_memory = [text for seq, _, text in self.memory if first_seq <= seq < end_seq]
+
+        lines = []
+        for segment in segments:
+            start = max(first_seq, segment.first_seq)
+            block = (start - segment.first_seq) // 64
+            try:
+                with open(segment.path, encoding='utf-8') as f:
+                    f.seek(segment.offsets[block])
+                    for line in f:
+                        seq, _, text = json.loads(line)
+                        if seq >= end_seq:
+                            break
+                        if seq >= start:
+                            lines.append(text)
+            except (OSError, IndexError, ValueError):
+                continue  # Purged while we were reading
+        return lines + in_memory
+
+    def purge(self):
+        """Drop log entries, spill files and offline members older than the retention."""
+        cutoff = time.time() - self.retention
+        removed = []
+        with self.lock:
+            while self.offline:
+                key, (_, since) = next(iter(self.offline.items()))
+                if since >= cutoff:
+                    break
+                del self.offline[key]
+
+            # Entries only offline members could still need are kept
+            oldest_needed = min((seq for seq, _ in self.offline.values()), default=self.next_seq)
+            while self.segments and (self.segments[0].last_time < cutoff
+                                     or self.segments[0].last_seq < oldest_needed):
+                segment = self.segments.popleft()
+                if not self.segments and self.spill_file:
+                    self.spill_file.close()
+                    self.spill_file = None
+                removed.append(segment.path)
+            while self.memory and (self.memory[0][1] < cutoff or self.memory[0][0] < oldest_needed):
+                self.memory.popleft()
+
+        for path in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'offline': len(self.offline),
+                'in_memory': len(self.memory),
+                'spilled': sum(s.count for s in self.segments),
+            }
+
+    def close(self):
+        with self.lock:
+            if self.spill_file:
+                self.spill_file.close()
+                self.spill_file = None
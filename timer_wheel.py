@@ -0,0 +1,83 @@
+import threading
+import time
+
+class Timer:
+    """Handle for a callback scheduled on a TimerWheel."""
+    def __init__(self, wheel, deadline, callback, args):
+        self.wheel = wheel
+        self.deadline = deadline  # Absolute tick number
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+class TimerWheel:
+    """Hashed timer wheel driven by a single background thread.
+
+    Timers are hashed into slots by their deadline tick, so scheduling and
+    cancelling are O(1) and each tick only looks at one slot, no matter how
+    many timers are pending. Deadlines are rounded up to whole ticks.
+    Callbacks run on the wheel thread and must not block. Exceptions they
+    raise are passed to on_error(text).
+    """
+    def __init__(self, tick=0.1, slots=512, on_error=print):
+        self.tick = tick
+        self.on_error = on_error
+        self.slots = [set() for _ in range(slots)]
+        self.lock = threading.Lock()
+        self.current_tick = 0
+        self.running = False
+        self.thread = None
+
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) after about delay seconds and return a Timer."""
+        ticks = max(1, int(-(-delay // self.tick)))
+        with self.lock:
+            timer = Timer(self, self.current_tick + ticks, callback, args)
+            self.slots[timer.deadline % len(self.slots)].add(timer)
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            timer.cancelled = True
+            self.slots[timer.deadline % len(self.slots)].discard(timer)
+
+    def advance(self):
+        """Move the wheel forward one tick and run the timers that are due."""
+        with self.lock:
+            self.current_tick += 1
+            slot = self.slots[self.current_tick % len(self.slots)]
+            # Timers more than one revolution away share the slot but stay put
+            due = [timer for timer in slot if timer.deadline <= self.current_tick]
+            for timer in due:
+                slot.discard(timer)
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                self.on_error(f"Error in timer callback: {e}")
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        next_tick = time.monotonic() + self.tick
+        while self.running:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            # Catch up if callbacks or scheduling made us fall behind
+            while self.running and time.monotonic() >= next_tick:
+                self.advance()
+                next_tick += self.tick
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+# Events in the order a traced message passes them. The client_* events are
+# written by the sender, server_* by the server (server_send once per
+# recipient) and recipient_* by each recipient.
+EVENTS = (
+    'client_compose',     # Sender has the text, before encrypting
+    'client_sent',        # Sender is about to write the encrypted frame to its socket
+    'server_receive',     # Server has read the whole frame
+    'server_admit',       # Rate limiter has let it through, after any delay
+    'server_decrypt',     # Server has decrypted it
+    'server_fanout',      # Server starts encrypting and sending to recipients
+    'server_send',        # Server is about to write the frame to one recipient
+    'recipient_receive',  # Recipient has read the whole frame
+    'recipient_deliver',  # Recipient has decrypted it and passed it to the front-end
+)
+
+class LatencyTracer:
+    """Append-only text file of timestamped events for traced messages.
+
+    One line per event: monotonic time, process, trace id, event and peer,
+    tab separated. Every process on one machine reads the same monotonic
+    clock, so the files written by the sender, the server and the
+    recipients can be merged by latency_report.py without clock sync.
+    peer is the recipient's key fingerprint for per-recipient events.
+    """
+    def __init__(self, path, process=None):
+        self.path = path
+        self.process = process or f"pid{os.getpid()}"
+        self.file = open(path, 'w', encoding='utf-8', buffering=64 * 1024)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def record(self, trace_id, event, peer='', when=None):
+        if when is None:
+            when = time.monotonic()
+        line = f"{when:.6f}\t{self.process}\t{trace_id}\t{event}\t{peer}\n"
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(line)
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+def read_events(path):
+    """Yield (time, process, trace_id, event, peer) from a file written by LatencyTracer."""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 5:
+                continue  # Cut short when the process was killed
+            yield float(fields[0]), fields[1], fields[2], fields[3], fields[4]
+
+def parse_trace(value):
+    """(trace_id, composed_at) from a chat frame's 'trace' field, or None if it isn't valid.
+
+    The id ends up in a tab separated file, so only short alphanumeric ids
+    are accepted.
+    """
+    try:
+        trace_id, composed_at = value
+        if not (isinstance(trace_id, str) and trace_id.isalnum() and len(trace_id) <= 32):
+            return None
+        return trace_id, float(composed_at)
+    except (TypeError, ValueError):
+        return None